@@ -35,6 +35,13 @@ def run_search(problem, search_function, parameter=None):
     end = timer()
     print("\n# Actions   Expansions   Goal Tests   New Nodes")
     print("{}\n".format(ip))
+    cache = getattr(problem, 'heuristic_cache', None)
+    if cache is not None and cache.hits + cache.misses:
+        print("Heuristic cache: {} hits, {} misses, {} evictions\n".format(
+            cache.hits, cache.misses, cache.evictions))
+    store = getattr(problem, 'heuristic_store', None)
+    if store is not None:
+        print("Heuristic store: {} hits, {} misses\n".format(store.hits, store.misses))
     show_solution(node, end - start)
     print()
 
@@ -168,3 +175,40 @@ def decode_state(state, fluent_map):
         else:
             fs.neg.append(fluent_map[idx])
     return fs
+
+
+def pack_state(state):
+    """ Convert an ordered sequence of True/False values into an integer bitset
+
+    Parameters
+    ----------
+    state:
+        A state represented as an ordered sequence of True/False values
+
+    Returns
+    -------
+    int where bit i is set if and only if state[i] is True
+    """
+    bits = 0
+    for idx, elem in enumerate(state):
+        if elem:
+            bits |= 1 << idx
+    return bits
+
+
+def unpack_state(bits, size):
+    """ Convert an integer bitset into an ordered tuple of True/False values
+
+    Parameters
+    ----------
+    bits: int
+        A state represented as an integer bitset (see pack_state)
+
+    size: int
+        The number of fluents in the state (i.e., len(fluent_map))
+
+    Returns
+    -------
+    tuple of True/False elements where element i is the value of bit i
+    """
+    return tuple([bool(bits >> idx & 1) for idx in range(size)])
@@ -0,0 +1,223 @@
+import hashlib
+import sqlite3
+from collections import OrderedDict
+from functools import wraps
+
+from _utils import pack_state
+
+
+class HeuristicCache:
+    """ Bounded least-recently-used cache of heuristic values keyed by state
+
+    Unlike functools.lru_cache on a heuristic method, the cache key does not
+    include the problem or the search Node, so nodes (and their chain of
+    parents) are not kept alive by the cache, and a state that is reached again
+    through a different path reuses the stored value.
+
+    Attributes
+    ----------
+    maxsize : int or None
+        The maximum number of values stored in the cache; the least recently
+        used value is evicted when the cache is full. None disables the bound
+        and 0 disables caching entirely.
+
+    hits, misses, evictions : int
+        Counters for the number of lookups answered from the cache, the number
+        of values computed, and the number of values evicted from the cache
+    """
+    def __init__(self, maxsize=2 ** 16):
+        self.maxsize = maxsize
+        self._values = OrderedDict()
+        self.hits = self.misses = self.evictions = 0
+
+    def __len__(self):
+        return len(self._values)
+
+    def __contains__(self, key):
+        return key in self._values
+
+    def __repr__(self):
+        return 'HeuristicCache(hits={}, misses={}, evictions={}, size={}/{})'.format(
+            self.hits, self.misses, self.evictions, len(self), self.maxsize)
+
+    def lookup(self, key, compute):
+        """ Return the value cached for key, calling compute() to produce (and
+        store) the value if it is not in the cache
+        """
+        try:
+            value = self._values[key]
+        except KeyError:
+            pass
+        else:
+            self.hits += 1
+            self._values.move_to_end(key)
+            return value
+        self.misses += 1
+        value = compute()
+        if self.maxsize != 0:
+            self._values[key] = value
+            if self.maxsize is not None and len(self._values) > self.maxsize:
+                self._values.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def clear(self):
+        """ Remove all values from the cache and reset the counters """
+        self._values.clear()
+        self.hits = self.misses = self.evictions = 0
+
+
+class HeuristicStore:
+    """ Persistent on-disk table of heuristic values shared across runs
+
+    Values are stored in a sqlite database keyed by a problem fingerprint (see
+    problem_fingerprint), the heuristic name and the packed state. The database
+    is opened in write-ahead-log mode so that any number of processes can read
+    it concurrently while another process writes. New values are buffered and
+    committed in batches of `batch_size`; call flush() (or close()) to make the
+    remaining values visible to other processes.
+
+    Each process must use its own HeuristicStore instance; pickling a store (e.g.,
+    to send it to a worker process) only transfers the path and fingerprint, and
+    the copy opens its own connection.
+    """
+    def __init__(self, path, fingerprint, batch_size=256):
+        self.path = str(path)
+        self.fingerprint = fingerprint
+        self.batch_size = batch_size
+        self.hits = self.misses = 0
+        self._pending = []
+        self._conn = sqlite3.connect(self.path, timeout=60)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS heuristics ("
+                               "problem TEXT, heuristic TEXT, state BLOB, value NUMERIC, "
+                               "PRIMARY KEY (problem, heuristic, state)) WITHOUT ROWID")
+
+    def __getstate__(self):
+        return (self.path, self.fingerprint, self.batch_size)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def __repr__(self):
+        return 'HeuristicStore({!r}, hits={}, misses={})'.format(self.path, self.hits, self.misses)
+
+    def lookup(self, heuristic, state, compute):
+        """ Return the stored value of the heuristic for the state, calling compute()
+        to produce (and store) the value if it has not been stored before
+        """
+        value = self.get(heuristic, state)
+        if value is None:
+            value = compute()
+            self.put(heuristic, state, value)
+        return value
+
+    def get(self, heuristic, state):
+        """ Return the stored value of the heuristic for the state, or None """
+        row = self._conn.execute(
+            "SELECT value FROM heuristics WHERE problem = ? AND heuristic = ? AND state = ?",
+            (self.fingerprint, heuristic, self._pack(state))).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0]
+
+    def put(self, heuristic, state, value):
+        """ Store the value of the heuristic for the state """
+        self._pending.append((self.fingerprint, heuristic, self._pack(state), value))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """ Commit the buffered values to the database """
+        if self._pending:
+            with self._conn:
+                self._conn.executemany("INSERT OR IGNORE INTO heuristics VALUES (?, ?, ?, ?)", self._pending)
+            self._pending = []
+
+    def close(self):
+        """ Commit the buffered values and close the database connection """
+        self.flush()
+        self._conn.close()
+
+    @staticmethod
+    def _pack(state):
+        bits = state if isinstance(state, int) else pack_state(state)
+        return bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+
+
+def problem_fingerprint(problem):
+    """ Return a digest identifying a planning problem by its fluents, goal and
+    actions, so that stored heuristic values are only shared by equivalent problems
+    """
+    def names(items):
+        return sorted(str(x) for x in items)
+
+    parts = [names(problem.state_map), names(problem.goal)]
+    for action in problem.actions_list:
+        parts.append([str(action)] + [names(x) for x in (action.precond_pos, action.precond_neg,
+                                                         action.effect_add, action.effect_rem)])
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+def cached_heuristic(fn):
+    """ Decorate a heuristic method of a planning problem so that its values are
+    stored in the problem's heuristic_cache, keyed by the heuristic name and the
+    state of the node (rather than by the node itself)
+
+    Values missing from the cache are read from (or written to) the problem's
+    heuristic_store when one is attached.
+    """
+    name = fn.__name__
+
+    @wraps(fn)
+    def memoized_heuristic(self, node):
+        def compute():
+            if self.heuristic_store is None:
+                return fn(self, node)
+            return self.heuristic_store.lookup(name, node.state, lambda: fn(self, node))
+        return self.heuristic_cache.lookup((name, node.state), compute)
+    return memoized_heuristic
+
+
+def prefetch_heuristic(problem, heuristic, states, evaluate):
+    """ Fill the heuristic cache of a planning problem with the values of a
+    heuristic for many states at once
+
+    Values of states that are not in the problem's heuristic_cache are read from
+    its heuristic_store when one is attached (as by cached_heuristic), and the
+    remaining states are passed to evaluate together. The computed values are
+    written to the cache and to the store.
+
+    Parameters
+    ----------
+    problem : BasePlanningProblem
+
+    heuristic : str
+        The name of a heuristic method decorated with cached_heuristic
+
+    states : iterable
+        States in either representation accepted by the problem
+
+    evaluate : callable
+        A function of a list of states that returns the list of their values
+    """
+    cache, store = problem.heuristic_cache, problem.heuristic_store
+    missing = [s for s in dict.fromkeys(states) if (heuristic, s) not in cache]
+    values = {}
+    if store is not None:
+        for state in missing:
+            value = store.get(heuristic, state)
+            if value is not None:
+                values[state] = value
+        missing = [s for s in missing if s not in values]
+    if missing:
+        for state, value in zip(missing, evaluate(missing)):
+            values[state] = value
+            if store is not None:
+                store.put(heuristic, state, value)
+    for state, value in values.items():
+        cache.lookup((heuristic, state), lambda: value)
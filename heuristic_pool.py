@@ -0,0 +1,100 @@
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent / "lectures"))
+
+from aimacode.search import Node
+from _utils import pack_state
+from heuristic_cache import prefetch_heuristic
+
+
+# the planning problem of a worker process, built once by _init_worker
+_worker_problem = None
+
+
+def _init_worker(problem_factory, planning_graph):
+    global _worker_problem
+    _worker_problem = problem_factory()
+    if planning_graph is not None:
+        _worker_problem.planning_graph = planning_graph
+
+
+def _evaluate(heuristic, packed_states):
+    method = getattr(_worker_problem, heuristic)
+    return [method(Node(bits)) for bits in packed_states]
+
+
+class HeuristicPool:
+    """ Evaluate a heuristic of a planning problem for many states in a pool of
+    worker processes
+
+    Every worker rebuilds the problem once by calling problem_factory (e.g.,
+    air_cargo_p2), because the symbolic expressions of a problem cache hash values
+    that are not valid in another process. States are sent to the workers packed
+    into integer bitsets, and the values computed by the workers are stored in the
+    heuristic cache (and the heuristic store, if any) of the problem in the main
+    process.
+
+    Instances are callable with a list of states, so they can be passed as the
+    heuristic_batch hook of aimacode.search.best_first_graph_search or astar_search.
+    The heuristic values are the same as evaluating the heuristic in the main
+    process, so the order in which the search expands nodes does not change.
+
+    Example
+    -------
+
+    >>> problem = air_cargo_p2()
+    >>> with HeuristicPool(problem, air_cargo_p2, 'h_pg_levelsum') as pool:
+    ...     astar_search(problem, problem.h_pg_levelsum, heuristic_batch=pool)
+    """
+    def __init__(self, problem, problem_factory, heuristic, max_workers=None):
+        """
+        Parameters
+        ----------
+        problem : BasePlanningProblem
+            The problem being searched in the main process
+
+        problem_factory : callable
+            A picklable function with no arguments that returns an equivalent
+            problem (used to build the problem in each worker process)
+
+        heuristic : str or callable
+            A heuristic method of the problem, or its name
+
+        max_workers : int, optional
+            The number of worker processes (defaults to the number of CPUs)
+        """
+        self.problem = problem
+        self.name = getattr(heuristic, '__name__', heuristic)
+        self.max_workers = max_workers or os.cpu_count() or 1
+        planning_graph = problem.planning_graph if 'planning_graph' in vars(problem) else None
+        self._executor = ProcessPoolExecutor(
+            self.max_workers, initializer=_init_worker, initargs=(problem_factory, planning_graph))
+
+    def __call__(self, states):
+        """ Return the heuristic values of the states, evaluating the states that
+        are not in the heuristic cache (or heuristic store) of the problem in the
+        worker processes
+        """
+        name = self.name
+        states = list(states)
+        prefetch_heuristic(self.problem, name, states, self._evaluate)
+        method = getattr(self.problem, name)
+        return [method(Node(state)) for state in states]
+
+    def _evaluate(self, states):
+        packed = [s if isinstance(s, int) else pack_state(s) for s in states]
+        size = -(-len(packed) // self.max_workers)
+        chunks = [packed[i:i + size] for i in range(0, len(packed), size)]
+        return [v for chunk in self._executor.map(_evaluate, [self.name] * len(chunks), chunks) for v in chunk]
+
+    def close(self):
+        """ Shut down the worker processes """
+        self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
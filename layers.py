@@ -4,9 +4,9 @@ sys.path.insert(0, str(Path(__file__).parent.parent / "lectures"))
 
 from copy import deepcopy
 from functools import lru_cache
-from itertools import combinations
+from itertools import chain, combinations
 from collections import defaultdict
-from collections.abc import MutableSet
+from collections.abc import Mapping, MutableSet
 
 from aimacode.planning import Action
 from aimacode.utils import expr, Expr
@@ -46,6 +46,189 @@ def makeNoOp(literal):
             Action(~action, [{~literal}, []], [{~literal}, []]))
 
 
+class CompiledProblem:
+    """ Problem-level structure shared by every planning graph built for the same
+    problem, so that each graph only performs the work that depends on its state
+
+    Attributes
+    ----------
+    literals : list
+        Every positive and negative literal of the problem; the literals of
+        fluent state_map[i] have ids 2*i (positive) and 2*i + 1 (negative)
+
+    literal_ids : dict
+        Mapping from each literal to its integer id
+
+    action_nodes : list
+        The ActionNode of every no-op (first, in state_map order) and every
+        action in the problem; the integer id of an action is its index
+
+    preconditions : list
+        preconditions[i] is a tuple of the literal ids required by action i
+
+    effects : list
+        effects[i] is a tuple of the literal ids produced by action i
+
+    consumers : list
+        consumers[j] is a tuple of the ids of the actions that have literal j
+        as a precondition
+    """
+    def __init__(self, state_map, actions_list):
+        self.state_map = state_map
+        self.actions_list = actions_list
+        no_ops = [make_node(n, no_op=True) for n in chain(*(makeNoOp(s) for s in state_map))]
+        self.action_nodes = no_ops + [make_node(a) for a in actions_list]
+        self.literals = list(chain(*((s, ~s) for s in state_map)))
+        self.literal_ids = {literal: idx for idx, literal in enumerate(self.literals)}
+        for action in self.action_nodes:
+            for literal in chain(action.preconditions, action.effects):
+                if literal not in self.literal_ids:
+                    self.literal_ids[literal] = len(self.literals)
+                    self.literals.append(literal)
+        self.preconditions = [tuple(sorted(self.literal_ids[l] for l in a.preconditions))
+                              for a in self.action_nodes]
+        self.effects = [tuple(sorted(self.literal_ids[l] for l in a.effects))
+                        for a in self.action_nodes]
+        consumers = [[] for _ in self.literals]
+        for action_id, literal_ids in enumerate(self.preconditions):
+            for literal_id in literal_ids:
+                consumers[literal_id].append(action_id)
+        self.consumers = [tuple(c) for c in consumers]
+        self.action_ids = {action: idx for idx, action in enumerate(self.action_nodes)}
+        self._compile_bitsets()
+
+    def _compile_bitsets(self):
+        """ Build the bitset tables used by BitsetLayer planning graphs
+
+        Literal sets are stored as ints with bit j set for literal id j, and
+        action sets as ints with bit i set for action id i.
+        """
+        literal_ids = self.literal_ids
+        self.negations = [literal_ids.get(~literal) for literal in self.literals]
+        self.precondition_masks = [sum(1 << j for j in ids) for ids in self.preconditions]
+        self.effect_masks = [sum(1 << j for j in ids) for ids in self.effects]
+        self.consumer_masks = [sum(1 << i for i in ids) for ids in self.consumers]
+        producers = [0] * len(self.literals)
+        for action_id, ids in enumerate(self.effects):
+            for j in ids:
+                producers[j] |= 1 << action_id
+        self.producer_masks = producers
+        self.no_op_mask = sum(1 << i for i, a in enumerate(self.action_nodes) if a.no_op)
+        self.action_mask = (1 << len(self.action_nodes)) - 1
+
+        # inconsistent effects and interference only depend on the pair of actions,
+        # so they are computed once: action b is statically mutex with action a if
+        # an effect of a negates an effect or precondition of b, or an effect of b
+        # negates a precondition of a
+        static = []
+        for action_id in range(len(self.action_nodes)):
+            row = 0
+            for j in self.effects[action_id]:
+                neg = self.negations[j]
+                if neg is not None:
+                    row |= producers[neg] | self.consumer_masks[neg]
+            for j in self.preconditions[action_id]:
+                neg = self.negations[j]
+                if neg is not None:
+                    row |= producers[neg]
+            static.append(row & ~(1 << action_id))
+        self.static_mutexes = static
+        self.static_mutex_index = {
+            self.action_nodes[action_id]: frozenset(self.action_nodes[idx] for idx in iter_bits(row))
+            for action_id, row in enumerate(static) if row}
+
+    def state_literals(self, state):
+        """ Return the literal ids that hold in a state given as an ordered sequence
+        of True/False values over state_map
+        """
+        return [2 * idx + (not value) for idx, value in enumerate(state)]
+
+
+def compile_problem(problem):
+    """ Return the CompiledProblem for a planning problem, building it the first
+    time it is requested (or when the actions of the problem have been replaced)
+    """
+    compiled = getattr(problem, '_compiled_planning_graph', None)
+    if (compiled is None or compiled.actions_list is not problem.actions_list
+            or compiled.state_map is not problem.state_map):
+        compiled = CompiledProblem(problem.state_map, problem.actions_list)
+        problem._compiled_planning_graph = compiled
+    return compiled
+
+
+def iter_bits(bits):
+    """ Yield the index of every set bit of a non-negative int in increasing order """
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+
+class BitsetLayer:
+    """ Planning graph layer over the dense integer ids of a CompiledProblem
+
+    Membership of the layer is a single int bitset, and the items that are mutex
+    with item i are stored as the bitset mutexes[i], so is_mutex() is a single AND.
+    Layers support the same read-only interface as BaseLayer (membership, len,
+    iteration and is_mutex) so they can replace them in planning graph heuristics.
+
+    Attributes
+    ----------
+    members : int
+        Bitset of the ids of the items in the layer
+
+    mutexes : list
+        mutexes[i] is the bitset of items that are mutex with item i in this layer
+        (zero for items that are not in the layer)
+
+    parent_layer : BitsetLayer
+        See BaseLayer.parent_layer
+
+    mutex_count : int
+        See BaseLayer.mutex_count
+    """
+    __slots__ = ['members', 'mutexes', 'parent_layer', '_items', '_ids']
+
+    def __init__(self, items, ids, members=0, mutexes=None, parent_layer=None):
+        """
+        Parameters
+        ----------
+        items : list
+            The item (literal or ActionNode) for each integer id
+
+        ids : dict
+            Mapping from each item to its integer id
+        """
+        self._items = items
+        self._ids = ids
+        self.members = members
+        self.mutexes = mutexes if mutexes is not None else [0] * len(items)
+        self.parent_layer = parent_layer
+
+    def __contains__(self, item):
+        idx = self._ids.get(item)
+        return idx is not None and bool(self.members >> idx & 1)
+
+    def __iter__(self):
+        return (self._items[idx] for idx in iter_bits(self.members))
+
+    def __len__(self):
+        return self.members.bit_count()
+
+    def __eq__(self, other):
+        return self.members == other.members and self.mutexes == other.mutexes
+
+    @property
+    def mutex_count(self):
+        return sum(row.bit_count() for row in self.mutexes) // 2
+
+    def is_mutex(self, itemA, itemB):
+        idxA, idxB = self._ids.get(itemA), self._ids.get(itemB)
+        if idxA is None or idxB is None:
+            return False
+        return bool(self.mutexes[idxA] & (1 << idxB))
+
+
 class ActionNode(object):
     """ Efficient representation of Actions for planning graph
 
@@ -88,6 +271,63 @@ class ActionNode(object):
                 and self.expr == other.expr)
 
 
+class LayerEdges(Mapping):
+    """ Mapping from the items of a planning graph layer to the set of nodes they
+    are connected to in an adjacent layer, stored as a delta over the edges of the
+    previous layer of the same kind
+
+    Planning graphs grow monotonically, so every edge of a layer is also an edge of
+    the next layer of the same kind. Instead of copying the edges of the previous
+    layer, each layer only stores the items whose edges changed at that level, and
+    lookups of the other items fall through to the previous layer. An item's set
+    is copied from the previous layer the first time the item gets a new edge, so
+    the sets of earlier layers are never modified.
+
+    Missing items map to an empty set (like a defaultdict, but without inserting
+    the item).
+    """
+    __slots__ = ("_edges", "_base")
+
+    def __init__(self, base=None):
+        self._edges = {}
+        self._base = base
+
+    def get(self, key, default=None):
+        edges = self
+        while edges is not None:
+            value = edges._edges.get(key)
+            if value is not None:
+                return value
+            edges = edges._base
+        return default
+
+    def __getitem__(self, key):
+        return self.get(key, frozenset())
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __iter__(self):
+        seen, edges = set(), self
+        while edges is not None:
+            for key in edges._edges:
+                if key not in seen:
+                    seen.add(key)
+                    yield key
+            edges = edges._base
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def extend(self, key, nodes):
+        """ Add edges from key to each of the nodes """
+        edges = self._edges.get(key)
+        if edges is None:
+            inherited = self._base.get(key, ()) if self._base is not None else ()
+            edges = self._edges[key] = set(inherited)
+        edges.update(nodes)
+
+
 class BaseLayer(MutableSet):
     """ Base class for ActionLayer and LiteralLayer classes for planning graphs
     that stores actions or literals as a mutable set (which enables terse,
@@ -95,13 +335,13 @@ class BaseLayer(MutableSet):
 
     Attributes
     ----------
-    parents : dict
+    parents : LayerEdges
         Mapping from each item (action or literal) in the current layer to the
         symbolic node(s) in parent layer of the planning graph. E.g.,
         parents[actionA] is a set containing the symbolic literals (positive AND
         negative) that are preconditions of the action.
 
-    children : dict
+    children : LayerEdges
         Mapping from each item (action or literal) in the current layer to the
         symbolic node(s) in the child layer of the planning graph. E.g.,
         children[actionA] is a set containing the symbolic literals (positive AND
@@ -123,6 +363,9 @@ class BaseLayer(MutableSet):
         If _ignore_mutexes is True then _dynamic_ mutexes will be ignored (static
         mutexes are *always* enforced). For example, a literal X is always mutex
         with ~X, but "competing needs" or "inconsistent support" can be skipped
+
+    mutex_count : int
+        The number of distinct mutex pairs in the layer
     """
 
     def __init__(self, items=[], parent_layer=None, ignore_mutexes=False):
@@ -140,9 +383,12 @@ class BaseLayer(MutableSet):
         """
         super().__init__()
         self.__store = set(iter(items))
-        self.parents = defaultdict(set)
-        self.children = defaultdict(set)
+        # layers built from a layer of the same kind share its edges (see LayerEdges)
+        shared = isinstance(items, type(self))
+        self.parents = LayerEdges(items.parents if shared else None)
+        self.children = LayerEdges(items.children if shared else None)
         self._mutexes = defaultdict(set)
+        self.mutex_count = 0
         self.parent_layer = parent_layer
         self._ignore_mutexes = ignore_mutexes
 
@@ -170,64 +416,141 @@ class BaseLayer(MutableSet):
             pass
 
     def set_mutex(self, itemA, itemB):
-        self._mutexes[itemA].add(itemB)
-        self._mutexes[itemB].add(itemA)
+        mutexes = self._mutexes[itemA]
+        if itemB not in mutexes:
+            mutexes.add(itemB)
+            self._mutexes[itemB].add(itemA)
+            self.mutex_count += 1
 
     def is_mutex(self, itemA, itemB):
         return itemA in self._mutexes.get(itemB, [])
 
 
 class BaseActionLayer(BaseLayer):
-    def __init__(self, actions=[], parent_layer=None, serialize=True, ignore_mutexes=False):
+    def __init__(self, actions=[], parent_layer=None, serialize=True, ignore_mutexes=False,
+                 static_mutexes=None):
+        """
+        Parameters
+        ----------
+        static_mutexes : dict, optional
+            Mapping from each action to the set of actions that are mutex with it by
+            inconsistent effects or interference (see CompiledProblem.static_mutex_index).
+            These mutexes do not depend on the level of the planning graph, so when
+            the index is provided they are read from it instead of being tested for
+            every pair of actions in the layer.
+        """
         super().__init__(actions, parent_layer, ignore_mutexes)
         self._serialize = serialize
-        if isinstance(actions, BaseActionLayer):
-            self.parents.update({k: set(v) for k, v in actions.parents.items()})
-            self.children.update({k: set(v) for k, v in actions.children.items()})
+        self._static_mutexes = static_mutexes
 
     def update_mutexes(self):
-        for actionA, actionB in combinations(iter(self), 2):
-            if self._serialize and actionA.no_op == actionB.no_op == False:
-                self.set_mutex(actionA, actionB)
-            elif (self._inconsistent_effects(actionA, actionB)
-                  or self._interference(actionA, actionB)):
+        """ Find the mutex pairs of the layer by testing only candidate pairs
+
+        Serialized actions are pairwise mutex. Otherwise a pair can only be mutex
+        if an effect of one action negates an effect or precondition of the other
+        (inconsistent effects & interference), or if a precondition of one action is
+        mutex with a precondition of the other in the parent layer (competing needs),
+        so candidates are generated from inverted indexes over the literals of the
+        actions in the layer instead of testing every pair of actions.
+        """
+        producers, consumers = defaultdict(set), defaultdict(set)
+        for action in self:
+            for literal in self.children.get(action, ()):
+                producers[literal].add(action)
+            for literal in self.parents.get(action, ()):
+                consumers[literal].add(action)
+
+        if self._serialize:
+            for actionA, actionB in combinations([a for a in self if not a.no_op], 2):
                 self.set_mutex(actionA, actionB)
-            elif self._ignore_mutexes:
+
+        for actionA in self:
+            if self._static_mutexes is not None:
+                for actionB in self._static_mutexes.get(actionA, ()):
+                    if actionB in self:
+                        self.set_mutex(actionA, actionB)
                 continue
-            elif self._competing_needs(actionA, actionB):
-                self.set_mutex(actionA, actionB)
+            candidates = set()
+            for literal in self.children.get(actionA, ()):
+                candidates |= producers.get(~literal, set()) | consumers.get(~literal, set())
+            for literal in self.parents.get(actionA, ()):
+                candidates |= producers.get(~literal, set())
+            for actionB in candidates:
+                if actionA == actionB or self.is_mutex(actionA, actionB):
+                    continue
+                if self._inconsistent_effects(actionA, actionB) or self._interference(actionA, actionB):
+                    self.set_mutex(actionA, actionB)
+
+        if self._ignore_mutexes or self.parent_layer is None:
+            return
+        for actionA in self:
+            for precondition in self.parents.get(actionA, ()):
+                for literal in self.parent_layer._mutexes.get(precondition, ()):
+                    for actionB in consumers.get(literal, ()):
+                        if actionA == actionB or self.is_mutex(actionA, actionB):
+                            continue
+                        if self._competing_needs(actionA, actionB):
+                            self.set_mutex(actionA, actionB)
 
     def add_inbound_edges(self, action, literals):
         # inbound action edges are many-to-one
-        self.parents[action] |= set(literals)
+        self.parents.extend(action, literals)
 
     def add_outbound_edges(self, action, literals):
         # outbound action edges are one-to-many
-        self.children[action] |= set(literals)
+        self.children.extend(action, literals)
 
 
 class BaseLiteralLayer(BaseLayer):
     def __init__(self, literals=[], parent_layer=None, ignore_mutexes=False):
         super().__init__(literals, parent_layer, ignore_mutexes)
-        if isinstance(literals, BaseLiteralLayer):
-            self.parents.update({k: set(v) for k, v in literals.parents.items()})
-            self.children.update({k: set(v) for k, v in literals.children.items()})
 
     def update_mutexes(self):
-        for literalA, literalB in combinations(iter(self), 2):
-            if self._negation(literalA, literalB):
-                self.set_mutex(literalA, literalB)
-            elif self._ignore_mutexes:
-                continue
-            elif len(self.parent_layer) and self._inconsistent_support(literalA, literalB):
-                self.set_mutex(literalA, literalB)
+        """ Find the mutex pairs of the layer by testing only candidate pairs
+
+        A literal can only be mutex with its negation, or, by inconsistent support,
+        with literals whose achievers are all mutex with the achievers of the first
+        literal; candidates for the latter are the literals produced by actions that
+        are mutex with one achiever of the first literal in the parent layer.
+        """
+        for literal in self:
+            negation = ~literal
+            if negation in self and self._negation(literal, negation):
+                self.set_mutex(literal, negation)
+
+        if self._ignore_mutexes or not self.parent_layer:
+            return
+        produced, unsupported = defaultdict(set), set()
+        for literal in self:
+            achievers = self.parents.get(literal, ())
+            if not achievers:
+                unsupported.add(literal)
+            for action in achievers:
+                produced[action].add(literal)
+
+        action_mutexes = self.parent_layer._mutexes
+        for literalA in self:
+            achievers = self.parents.get(literalA, ())
+            if achievers:
+                # every achiever of a mutex literal must be mutex with this achiever
+                achiever = min(achievers, key=lambda a: len(action_mutexes.get(a, ())))
+                candidates = set(unsupported)
+                for action in action_mutexes.get(achiever, ()):
+                    candidates |= produced.get(action, set())
+            else:
+                candidates = self
+            for literalB in candidates:
+                if literalA == literalB or self.is_mutex(literalA, literalB):
+                    continue
+                if self._inconsistent_support(literalA, literalB):
+                    self.set_mutex(literalA, literalB)
 
     def add_inbound_edges(self, action, literals):
         # inbound literal edges are many-to-many
         for literal in literals:
-            self.parents[literal].add(action)
+            self.parents.extend(literal, (action,))
 
     def add_outbound_edges(self, action, literals):
         # outbound literal edges are many-to-many
         for literal in literals:
-            self.children[literal].add(action)
+            self.children.extend(literal, (action,))
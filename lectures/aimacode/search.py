@@ -8,7 +8,17 @@ from .utils import (
     is_in, memoize, print_table, Stack, FIFOQueue, PriorityQueue, name
 )
 
+import heapq
+import multiprocessing
+import os
+import pickle
 import sys
+import zlib
+from array import array
+from collections import OrderedDict, deque
+from itertools import count
+from queue import Empty
+from time import perf_counter
 
 infinity = float('inf')
 
@@ -76,7 +86,14 @@ class Node:
     the total path_cost (also known as g) to reach the node.  Other functions
     may add an f and h value; see best_first_graph_search and astar_search for
     an explanation of how the f and h values are handled. You will not need to
-    subclass this class."""
+    subclass this class.
+
+    MODIFIED FROM AIMA VERSION
+        - Use __slots__, with explicit f and h fields for the values that
+          memoize(f, 'f') and memoize(h, 'h') store on nodes (g is the
+          path_cost), so nodes do not carry a per-instance __dict__"""
+
+    __slots__ = ('state', 'parent', 'action', 'path_cost', 'depth', 'f', 'h')
 
     def __init__(self, state, parent=None, action=None, path_cost=0):
         "Create a search tree Node, derived from a parent by an action."
@@ -88,6 +105,11 @@ class Node:
         if parent:
             self.depth = parent.depth + 1
 
+    @property
+    def g(self):
+        "The path cost from the root to this node."
+        return self.path_cost
+
     def __repr__(self):
         return "<Node %s>" % (self.state,)
 
@@ -129,6 +151,103 @@ class Node:
     def __hash__(self):
         return hash(self.state)
 
+
+class NodeStore:
+    """Parent-pointer arrays for the expanded nodes of a search.
+
+    A node is added to the store (and gets an integer index) when its first
+    child is generated; the children then refer to it by index instead of
+    holding a reference to it, so an expanded node is only kept as a few
+    array entries rather than as a Node object. Paths are rebuilt from the
+    arrays in solution() and path(). Pass a NodeStore as the node_store of
+    a search to use StoredNodes in place of Nodes."""
+
+    def __init__(self):
+        self.states, self.actions = [], []
+        self.parents = array('l')
+        self.path_costs, self.depths = array('d'), array('l')
+
+    def __len__(self):
+        return len(self.states)
+
+    def root(self, state):
+        "Return the root node of a search from state."
+        return StoredNode(self, state)
+
+    def add(self, node):
+        "Store an expanded node and return its index."
+        self.states.append(node.state)
+        self.actions.append(node.action)
+        self.parents.append(node.parent_index)
+        self.path_costs.append(node.path_cost)
+        self.depths.append(node.depth)
+        return len(self.states) - 1
+
+    def node(self, index):
+        "Return the stored node with the given index."
+        node = StoredNode(self, self.states[index], self.parents[index],
+                          self.actions[index], self.path_costs[index])
+        node.depth, node.index = self.depths[index], index
+        return node
+
+    def solution(self, index):
+        "Return the actions from the root to the stored node with the given index."
+        actions = []
+        while index >= 0:
+            actions.append(self.actions[index])
+            index = self.parents[index]
+        actions.pop()  # the root has no action
+        actions.reverse()
+        return actions
+
+
+class StoredNode(Node):
+    """A search Node that refers to its parent by its index in a NodeStore
+    rather than by reference. Instances are interchangeable with Nodes in
+    the search functions."""
+
+    __slots__ = ('store', 'index', 'parent_index')
+
+    def __init__(self, store, state, parent_index=-1, action=None, path_cost=0):
+        self.store = store
+        self.state = state
+        self.parent_index = parent_index
+        self.action = action
+        self.path_cost = path_cost
+        self.depth = store.depths[parent_index] + 1 if parent_index >= 0 else 0
+        self.index = -1
+
+    @property
+    def parent(self):
+        return self.store.node(self.parent_index) if self.parent_index >= 0 else None
+
+    def child_node(self, problem, action):
+        if self.index < 0:
+            self.index = self.store.add(self)
+        next_state = problem.result(self.state, action)
+        return StoredNode(self.store, next_state, self.index, action,
+                          problem.path_cost(self.path_cost, self.state,
+                                            action, next_state))
+
+    def solution(self):
+        if self.parent_index < 0:
+            return []
+        return self.store.solution(self.parent_index) + [self.action]
+
+    def path(self):
+        node, path_back = self, []
+        while node:
+            path_back.append(node)
+            node = node.parent
+        return list(reversed(path_back))
+
+
+def root_node(problem, node_store=None):
+    "Return the root Node of a search, or a StoredNode if node_store is given."
+    if node_store is None:
+        return Node(problem.initial)
+    return node_store.root(problem.initial)
+
 # ______________________________________________________________________________
 # Uninformed Search algorithms
 
@@ -178,9 +297,9 @@ def depth_first_graph_search(problem):
     return graph_search(problem, Stack())
 
 
-def breadth_first_search(problem):
+def breadth_first_search(problem, node_store=None):
     "[Figure 3.11]"
-    node = Node(problem.initial)
+    node = root_node(problem, node_store)
     if problem.goal_test(node.state):
         return node
     frontier = FIFOQueue()
@@ -197,20 +316,54 @@ def breadth_first_search(problem):
     return None
 
 
-def best_first_graph_search(problem, f):
+# Secondary heap keys that break ties between nodes with equal f values in
+# best_first_graph_search, called with the node and its insertion count; the
+# count always ends the key, so the frontier never compares Nodes.
+#   fifo   -- first in, first out
+#   lifo   -- last in, first out
+#   low_h  -- lowest h first; only for the searches that store h on their
+#             nodes (astar_search and greedy_best_first_graph_search)
+#   deep_g -- highest path cost g first
+def _low_h(node, tick):
+    try:
+        return node.h, tick
+    except AttributeError:
+        raise ValueError("low_h tie-breaking needs a search that stores h on its nodes "
+                         "(astar_search or greedy_best_first_graph_search)") from None
+
+
+TIE_BREAKERS = {
+    'fifo': lambda node, tick: (tick,),
+    'lifo': lambda node, tick: (-tick,),
+    'low_h': _low_h,
+    'deep_g': lambda node, tick: (-node.path_cost, tick),
+}
+
+
+def best_first_graph_search(problem, f, heuristic_batch=None, tie_breaking=None, node_store=None):
     """Search the nodes with the lowest f scores first.
     You specify the function f(node) that you want to minimize; for example,
     if f is a heuristic estimate to the goal, then we have greedy best
     first search; if f is node.depth then we have breadth-first search.
     There is a subtlety: the line "f = memoize(f, 'f')" means that the f
     values will be cached on the nodes as they are computed. So after doing
-    a best first search you can examine the f values of the path returned."""
-    
+    a best first search you can examine the f values of the path returned.
+    If heuristic_batch is given, it is called with the list of the states of
+    the new children of every expanded node before any of them is evaluated,
+    so that the heuristic can compute (and cache) their values together.
+    tie_breaking names one of the TIE_BREAKERS policies used to order nodes
+    with equal f values; by default, ties are broken by comparing states.
+    If node_store is given, the search uses StoredNodes kept in it."""
+
     f = memoize(f, 'f')
-    node = Node(problem.initial)
+    key = f
+    if tie_breaking is not None:
+        secondary, tick = TIE_BREAKERS[tie_breaking], count()
+        key = lambda node: (f(node),) + secondary(node, next(tick))
+    node = root_node(problem, node_store)
     if problem.goal_test(node.state):
         return node
-    frontier = PriorityQueue(min, f)
+    frontier = PriorityQueue(min, key)
     frontier.append(node)
     explored = set()
     while frontier:
@@ -218,20 +371,23 @@ def best_first_graph_search(problem, f):
         if problem.goal_test(node.state):
             return node
         explored.add(node.state)
-        for child in node.expand(problem):
+        children = list(node.expand(problem))
+        if heuristic_batch is not None:
+            heuristic_batch([child.state for child in children if child.state not in explored])
+        for child in children:
             if child.state not in explored and child not in frontier:
                 frontier.append(child)
             elif child in frontier:
                 incumbent = frontier[child]
                 if f(child) < f(incumbent):
-                    # del frontier[incumbent]
-                    frontier.append(child)
+                    frontier.decrease_key(child)
     return None
 
 
-def uniform_cost_search(problem):
+def uniform_cost_search(problem, tie_breaking=None, node_store=None):
     "[Figure 3.14]"
-    return best_first_graph_search(problem, lambda node: node.path_cost)
+    return best_first_graph_search(problem, lambda node: node.path_cost, tie_breaking=tie_breaking,
+                                   node_store=node_store)
 
 
 def depth_limited_search(problem, limit=50):
@@ -265,16 +421,309 @@ def iterative_deepening_search(problem):
 # ______________________________________________________________________________
 # Informed (Heuristic) Search
 
-greedy_best_first_graph_search = best_first_graph_search
-# Greedy best-first search is accomplished by specifying f(n) = h(n).
+def greedy_best_first_graph_search(problem, h=None, heuristic_batch=None, tie_breaking=None, node_store=None):
+    """Greedy best-first search is best-first graph search with f(n) = h(n).
+
+    MODIFIED FROM AIMA VERSION
+        - A function rather than an alias of best_first_graph_search, so that h
+          is memoized on the nodes (as in astar_search) for the low_h policy"""
+    h = memoize(h or problem.h, 'h')
+    return best_first_graph_search(problem, h, heuristic_batch, tie_breaking, node_store)
 
 
-def astar_search(problem, h=None):
+def astar_search(problem, h=None, heuristic_batch=None, tie_breaking=None, node_store=None):
     """A* search is best-first graph search with f(n) = g(n)+h(n).
     You need to specify the h function when you call astar_search, or
     else in your Problem subclass."""
     h = memoize(h or problem.h, 'h')
-    return best_first_graph_search(problem, lambda n: n.path_cost + h(n))
+    return best_first_graph_search(problem, lambda n: n.path_cost + h(n), heuristic_batch, tie_breaking,
+                                   node_store)
+
+
+def lazy_greedy_search(problem, h=None, preferred=None, preferred_ratio=1):
+    """Greedy best-first search with deferred evaluation.
+    Children are queued with the h value of their parent and are only
+    generated and evaluated when they are removed from the queue, so h is
+    computed once per expanded node instead of once per generated node.
+    If preferred is given, preferred(node) returns the preferred operators
+    of node (e.g., the helpful actions of a relaxed plan); the children they
+    reach are queued again in a second queue, and preferred_ratio nodes are
+    taken from that queue for every node taken from the regular queue.
+    Ties are broken in first-in first-out order. [Fast Downward lazy search]"""
+    h = memoize(h or problem.h, 'h')
+    queues = ([], [])  # regular, preferred
+    tick = count()
+    heapq.heappush(queues[0], (0, next(tick), Node(problem.initial), None))
+    closed = set()
+    turn = 0
+    while queues[0] or queues[1]:
+        use_preferred = bool(queues[1]) and (not queues[0] or turn % (preferred_ratio + 1) < preferred_ratio)
+        turn += 1
+        _, _, parent, action = heapq.heappop(queues[use_preferred])
+        node = parent if action is None else parent.child_node(problem, action)
+        if node.state in closed:
+            continue
+        closed.add(node.state)
+        if problem.goal_test(node.state):
+            return node
+        value = h(node)
+        if value == infinity:
+            continue
+        helpful = set(preferred(node)) if preferred is not None else ()
+        for action in problem.actions(node.state):
+            entry = (value, next(tick), node, action)
+            heapq.heappush(queues[0], entry)
+            if action in helpful:
+                heapq.heappush(queues[1], entry)
+    return None
+
+
+def enforced_hill_climbing_search(problem, h=None, preferred=None):
+    """Enforced hill-climbing search. From the current node, a breadth-first
+    lookahead searches for a node with a strictly lower h value (or a goal),
+    and the search commits to that node and the path to it. Each lookahead
+    starts with a fresh set of visited states, seeded with the states of the
+    committed path so that it never cycles back. If preferred is given, the
+    lookahead only follows the preferred operators of each node (e.g., the
+    helpful actions of a relaxed plan). If a lookahead finds no better node,
+    the search falls back to greedy best-first search from the initial
+    state. [Hoffmann & Nebel 2001, FF]"""
+    h = memoize(h or problem.h, 'h')
+    node = Node(problem.initial)
+    committed = {node.state}
+    while not problem.goal_test(node.state):
+        value, improved = h(node), None
+        closed = set(committed)
+        frontier = deque([node])
+        while frontier and improved is None:
+            current = frontier.popleft()
+            actions = preferred(current) if preferred is not None else problem.actions(current.state)
+            for action in actions:
+                child = current.child_node(problem, action)
+                if child.state in closed:
+                    continue
+                closed.add(child.state)
+                if problem.goal_test(child.state) or h(child) < value:
+                    improved = child
+                    break
+                if h(child) < infinity:
+                    frontier.append(child)
+        if improved is None:
+            return greedy_best_first_graph_search(problem, h)
+        committed.update(n.state for n in improved.path())
+        node = improved
+    return node
+
+
+def anytime_weighted_astar_search(problem, h=None, weights=(5, 3, 2, 1.5, 1), deadline=None):
+    """Anytime weighted A* search that reuses its search effort between
+    weights (ARA*). Nodes are expanded in order of f = g + w*h for each
+    weight w in turn; after each weight, the best plan found so far is
+    yielded as (node, bound), where the cost of the plan is at most bound
+    times the optimal cost (for an admissible h). The open list carries over
+    to the next weight, and states whose cost improved after they were
+    expanded are expanded again only once per weight. The generator stops
+    after the last weight, when the plan is proven optimal (bound 1), or
+    once perf_counter() passes deadline after the first plan has been found
+    (yielding the current plan first if it improved). [Likhachev et al. 2003]"""
+    h = memoize(h or problem.h, 'h')
+    root = Node(problem.initial)
+    if problem.goal_test(root.state):
+        yield root, 1
+        return
+    best = {root.state: root}  # lowest-cost node found for each state
+    open_states, incons = {root.state}, set()
+    incumbent, published, last_bound, tick = None, None, infinity, count()
+
+    def bound(w):
+        costs = [best[s].path_cost + h(best[s]) for s in open_states | incons]
+        lower = min(costs, default=incumbent.path_cost)
+        return max(1, min(w, incumbent.path_cost / lower if lower > 0 else w))
+
+    for w in weights:
+        open_states |= incons
+        incons, closed = set(), set()
+        frontier = [(best[s].path_cost + w * h(best[s]), next(tick), s) for s in open_states]
+        heapq.heapify(frontier)
+        while frontier:
+            key, _, state = frontier[0]
+            if state not in open_states or key != best[state].path_cost + w * h(best[state]):
+                heapq.heappop(frontier)  # stale entry
+                continue
+            if incumbent is not None and incumbent.path_cost <= key:
+                break
+            if deadline is not None and incumbent is not None and perf_counter() > deadline:
+                if incumbent is not published:
+                    yield incumbent, bound(infinity)
+                return
+            heapq.heappop(frontier)
+            open_states.discard(state)
+            closed.add(state)
+            for child in best[state].expand(problem):
+                known = best.get(child.state)
+                if known is not None and known.path_cost <= child.path_cost:
+                    continue
+                best[child.state] = child
+                if problem.goal_test(child.state):
+                    if incumbent is None or child.path_cost < incumbent.path_cost:
+                        incumbent = child
+                elif child.state in closed:
+                    incons.add(child.state)
+                else:
+                    open_states.add(child.state)
+                    heapq.heappush(frontier, (child.path_cost + w * h(child), next(tick), child.state))
+        if incumbent is None:
+            return
+        epsilon = bound(w)
+        if incumbent is not published or epsilon < last_bound:
+            published, last_bound = incumbent, epsilon
+            yield incumbent, epsilon
+        if epsilon == 1:
+            return
+
+
+def anytime_astar_search(problem, h=None, budget=None, weights=(5, 3, 2, 1.5, 1)):
+    """Return the best plan found by anytime_weighted_astar_search within
+    budget seconds (the first plan is always completed). Without a budget,
+    the search runs through all the weights."""
+    deadline = perf_counter() + budget if budget is not None else None
+    node = None
+    for node, _ in anytime_weighted_astar_search(problem, h, weights, deadline):
+        pass
+    return node
+
+# ______________________________________________________________________________
+# Arena-backed search: nodes are integer indices into parallel arrays
+
+
+class NodeArena:
+    """Struct-of-arrays storage for the nodes of a search.
+
+    Node i is described by states[i], parents[i] (the index of its parent,
+    or -1 for the root), action_ids[i] (an index into actions, or -1 for the
+    root), g[i] and depths[i]; all but states are typed arrays, and states
+    is a typed array too when the states are ints that fit in 64 bits (such
+    as packed planning states), so a node costs a few tens of bytes instead
+    of a Node object. Searches on an arena only build Node objects for the
+    path of the solution (see node())."""
+
+    def __init__(self, packed=False):
+        self.states = array('Q') if packed else []
+        self.parents, self.action_ids = array('l'), array('l')
+        self.g, self.depths = array('d'), array('l')
+        self.actions, self._action_index = [], {}
+
+    def __len__(self):
+        return len(self.parents)
+
+    def add(self, state, parent=-1, action=None, g=0):
+        "Add a node and return its index."
+        try:
+            self.states.append(state)
+        except (TypeError, OverflowError):
+            self.states = list(self.states)
+            self.states.append(state)
+        if action is None:
+            self.action_ids.append(-1)
+        else:
+            action_id = self._action_index.get(action)
+            if action_id is None:
+                action_id = self._action_index[action] = len(self.actions)
+                self.actions.append(action)
+            self.action_ids.append(action_id)
+        self.parents.append(parent)
+        self.g.append(g)
+        self.depths.append(self.depths[parent] + 1 if parent >= 0 else 0)
+        return len(self.parents) - 1
+
+    def solution(self, index):
+        "Return the actions from the root to the node at index."
+        return [self.actions[self.action_ids[i]] for i in self.path(index)[1:]]
+
+    def path(self, index):
+        "Return the indices of the nodes from the root to the node at index."
+        path_back = []
+        while index >= 0:
+            path_back.append(index)
+            index = self.parents[index]
+        return list(reversed(path_back))
+
+    def node(self, index):
+        "Return a Node (with its chain of parents) for the node at index."
+        node = None
+        for i in self.path(index):
+            action = self.actions[self.action_ids[i]] if self.action_ids[i] >= 0 else None
+            node = Node(self.states[i], node, action, self.g[i])
+        return node
+
+
+def arena_breadth_first_search(problem, arena=None):
+    """Breadth-first search over the indices of a NodeArena; expands the same
+    nodes as breadth_first_search and returns the goal as a Node."""
+    if arena is None:
+        arena = NodeArena(isinstance(problem.initial, int))
+    index = arena.add(problem.initial)
+    if problem.goal_test(problem.initial):
+        return arena.node(index)
+    frontier = deque([index])
+    reached = {problem.initial}  # explored and frontier states
+    while frontier:
+        index = frontier.popleft()
+        state, g = arena.states[index], arena.g[index]
+        for action in problem.actions(state):
+            child = problem.result(state, action)
+            if child not in reached:
+                reached.add(child)
+                child_index = arena.add(child, index, action, problem.path_cost(g, state, action, child))
+                if problem.goal_test(child):
+                    return arena.node(child_index)
+                frontier.append(child_index)
+    return None
+
+
+def arena_best_first_search(problem, f, arena=None):
+    """Best-first graph search over the indices of a NodeArena.
+    f(state, g) is the priority of a node with the given state and path cost.
+    Ties are broken in last-in first-out order (the arena index of a node is
+    its insertion order). A better path to a state in the frontier is queued
+    as a new node, and the entry of the old node is skipped when it is popped
+    after the state has been explored."""
+    if arena is None:
+        arena = NodeArena(isinstance(problem.initial, int))
+    index = arena.add(problem.initial)
+    frontier = [(f(problem.initial, 0), -index)]
+    reached = {problem.initial: index}  # best node of each state; -1 once explored
+    while frontier:
+        index = -heapq.heappop(frontier)[1]
+        state = arena.states[index]
+        if reached[state] != index:
+            continue
+        if problem.goal_test(state):
+            return arena.node(index)
+        reached[state] = -1
+        g = arena.g[index]
+        for action in problem.actions(state):
+            child = problem.result(state, action)
+            incumbent = reached.get(child)
+            if incumbent == -1:
+                continue
+            child_g = problem.path_cost(g, state, action, child)
+            if incumbent is None or child_g < arena.g[incumbent]:
+                child_index = reached[child] = arena.add(child, index, action, child_g)
+                heapq.heappush(frontier, (f(child, child_g), -child_index))
+    return None
+
+
+def arena_uniform_cost_search(problem, arena=None):
+    "Uniform-cost search over the indices of a NodeArena."
+    return arena_best_first_search(problem, lambda state, g: g, arena)
+
+
+def arena_astar_search(problem, h=None, arena=None):
+    """A* search over the indices of a NodeArena. h is called with a
+    temporary Node for the state being evaluated."""
+    h = h or problem.h
+    return arena_best_first_search(problem, lambda state, g: g + h(Node(state, path_cost=g)), arena)
 
 # ______________________________________________________________________________
 # Other search algorithms
@@ -287,7 +736,7 @@ def recursive_best_first_search(problem, h=None):
     def RBFS(problem, node, flimit):
         if problem.goal_test(node.state):
             return node, 0   # (The second value is immaterial)
-        successors = node.expand(problem)
+        successors = list(node.expand(problem))
         if len(successors) == 0:
             return None, infinity
         for s in successors:
@@ -311,6 +760,250 @@ def recursive_best_first_search(problem, h=None):
     result, bestf = RBFS(problem, node, infinity)
     return result
 
+
+def iterative_deepening_astar_search(problem, h=None, table_size=2 ** 16, thresholds=None):
+    """Iterative deepening A* search without recursion.
+    Each iteration is a depth-first search (with an explicit stack) that
+    prunes nodes whose f = g + h exceeds the current threshold; the next
+    threshold is the smallest f value that was pruned. Only the current path
+    is kept in memory, plus a transposition table of at most table_size
+    states (least recently used states are evicted first) recording the
+    lowest g with which each state was reached in the current iteration, so
+    that a state reached again with a cost at least as high is not searched
+    again. If thresholds is a list, the threshold of every iteration is
+    appended to it. Returns an optimal solution if h is admissible."""
+    h = memoize(h or problem.h, 'h')
+    root = Node(problem.initial)
+    if problem.goal_test(root.state):
+        return root
+    table = OrderedDict()  # state -> (iteration, g)
+    bound, iteration = h(root), 0
+    while bound < infinity:
+        if thresholds is not None:
+            thresholds.append(bound)
+        next_bound = infinity
+        stack, on_path = [(root, iter(problem.actions(root.state)))], {root.state}
+        while stack:
+            node, actions = stack[-1]
+            action = next(actions, None)
+            if action is None:
+                stack.pop()
+                on_path.discard(node.state)
+                continue
+            child = node.child_node(problem, action)
+            if child.state in on_path:
+                continue
+            seen = table.get(child.state)
+            if seen is not None and seen[0] == iteration and seen[1] <= child.path_cost:
+                continue
+            f = child.path_cost + h(child)
+            if f > bound:
+                next_bound = min(next_bound, f)
+                continue
+            if problem.goal_test(child.state):
+                return child
+            table[child.state] = (iteration, child.path_cost)
+            table.move_to_end(child.state)
+            if len(table) > table_size:
+                table.popitem(last=False)
+            stack.append((child, iter(problem.actions(child.state))))
+            on_path.add(child.state)
+        bound, iteration = next_bound, iteration + 1
+    return None
+
+# ______________________________________________________________________________
+# Hash-distributed A* (HDA*) in worker processes
+
+
+def state_owner(state, workers):
+    """Return the index of the worker that owns state. The owner is computed
+    from a CRC of the packed encoding of the state (its bytes for integer
+    bitsets, its pickle otherwise), so it is the same in every process,
+    unlike hash() of strings and symbolic expressions."""
+    if isinstance(state, int):
+        data = state.to_bytes(state.bit_length() // 8 + 1, 'little', signed=True)
+    else:
+        data = pickle.dumps(state, 4)
+    return zlib.crc32(data) % workers
+
+
+def _hda_worker(index, problem_factory, problem, h, inboxes, results, lock, counters, done, batch_size):
+    """The loop of an HDA* worker process. The worker owns the states with
+    state_owner(state) == index: it keeps their lowest g (with the parent
+    state and the index of the action that reached them) and an open list of
+    the owned states that have not been expanded with that g. Generated
+    children are sent to their owners in batches of ('nodes', entries)
+    messages; ('trace', state) messages are answered with the parent of the
+    state, and None stops the worker."""
+    problem = InstrumentedProblem(problem_factory() if problem_factory is not None else problem)
+    h = getattr(problem, h) if isinstance(h, str) else (h or problem.h)
+    outstanding, idle_workers, incumbent = counters
+    workers, inbox = len(inboxes), inboxes[index]
+    for queue in inboxes:
+        # batches still buffered when the search is cancelled must not block the exit
+        queue.cancel_join_thread()
+    table = {}  # state -> (g, parent state, action index)
+    frontier, tick = [], count()
+    buffers = [[] for _ in range(workers)]
+
+    def insert(entries):
+        for state, g, parent, action in entries:
+            seen = table.get(state)
+            if seen is not None and seen[0] <= g:
+                continue
+            table[state] = (g, parent, action)
+            if problem.goal_test(state):
+                with lock:
+                    if g < incumbent.value:
+                        incumbent.value = g
+                        results.put(('goal', g, state))
+                continue
+            f = g + h(Node(state, path_cost=g))
+            if f < incumbent.value:
+                heapq.heappush(frontier, (f, -g, next(tick), state))
+
+    def flush():
+        batches = [(owner, entries) for owner, entries in enumerate(buffers) if entries]
+        if batches:
+            with lock:
+                outstanding.value += len(batches)
+            for owner, entries in batches:
+                inboxes[owner].put(('nodes', entries))
+                buffers[owner] = []
+
+    def handle(message):
+        kind, payload = message
+        if kind == 'nodes':
+            insert(payload)
+            with lock:
+                outstanding.value -= 1
+        else:
+            results.put(('trace',) + table[payload][1:])
+
+    active = False
+    while True:
+        while frontier and (frontier[0][0] >= incumbent.value or
+                            table[frontier[0][3]][0] != -frontier[0][1]):
+            heapq.heappop(frontier)
+        if not frontier:
+            flush()
+            if active:
+                active = False
+                with lock:
+                    idle_workers.value += 1
+                    if idle_workers.value == workers and outstanding.value == 0:
+                        done.set()
+            message = inbox.get()
+            if message is None:
+                break
+            if message[0] == 'nodes' and not active:
+                active = True
+                with lock:
+                    idle_workers.value -= 1
+            handle(message)
+            continue
+        for _ in range(batch_size):
+            if not frontier:
+                break
+            f, g, _, state = heapq.heappop(frontier)
+            g = -g
+            if g != table[state][0] or f >= incumbent.value:
+                continue
+            for i, action in enumerate(problem.actions(state)):
+                child = problem.result(state, action)
+                entry = (child, problem.path_cost(g, state, action, child), state, i)
+                owner = state_owner(child, workers)
+                if owner == index:
+                    insert([entry])
+                else:
+                    buffers[owner].append(entry)
+        flush()
+        while True:
+            try:
+                message = inbox.get_nowait()
+            except Empty:
+                break
+            handle(message)
+    results.put(('stats', problem.succs, problem.goal_tests, problem.states))
+
+
+def hash_distributed_astar_search(problem, h=None, problem_factory=None, workers=None, batch_size=64):
+    """A* search distributed over worker processes (HDA*). Every state is
+    owned by one worker (see state_owner), which keeps the open and closed
+    lists for its states and expands them in order of f = g + h; children
+    are sent to their owners in batches. A goal found by any worker becomes
+    the incumbent solution, and nodes with f >= its cost are pruned
+    everywhere. The search ends when every worker is idle (its open list is
+    empty or pruned) and no batch is in flight, which is detected with a
+    shared count of undelivered batches; with an admissible h, the incumbent
+    is then optimal. The plan is traced back through the owners of its
+    states and replayed on problem.
+
+    problem_factory is a picklable function with no arguments that returns
+    an equivalent problem, and is called once in each worker; without it,
+    problem itself is given to the workers (which is only safe if hash
+    values of its states and actions do not depend on the process). h is a
+    method of the problem (looked up again by name in each worker) or a
+    picklable function of a node. workers defaults to the number of CPUs.
+    The expansion statistics of the workers are added to problem if it is
+    an InstrumentedProblem."""
+    workers = workers or os.cpu_count() or 1
+    if h is not None and getattr(h, '__self__', None) is not None:
+        h = h.__name__
+    context = multiprocessing.get_context()
+    inboxes = [context.Queue() for _ in range(workers)]
+    results, lock, done = context.Queue(), context.Lock(), context.Event()
+    counters = (context.RawValue('q', 1), context.RawValue('q', workers), context.RawValue('d', infinity))
+    processes = [context.Process(target=_hda_worker, daemon=True,
+                                 args=(index, problem_factory, None if problem_factory else problem, h,
+                                       inboxes, results, lock, counters, done, batch_size))
+                 for index in range(workers)]
+    for process in processes:
+        process.start()
+    try:
+        inboxes[state_owner(problem.initial, workers)].put(('nodes', [(problem.initial, 0, None, None)]))
+        while not done.wait(0.1):
+            if any(process.exitcode for process in processes):
+                raise RuntimeError("an HDA* worker process failed")
+        cost, goal, actions = counters[2].value, None, []
+        while goal is None and cost < infinity:
+            message = results.get()
+            if message[0] == 'goal' and message[1] == cost:
+                goal = message[2]
+        state = goal
+        while state is not None:
+            inboxes[state_owner(state, workers)].put(('trace', state))
+            message = results.get()
+            while message[0] != 'trace':
+                # goal messages of more expensive plans may arrive late
+                message = results.get()
+            state, action = message[1:]
+            if state is not None:
+                actions.append(action)
+        for inbox in inboxes:
+            inbox.put(None)
+        stats = []
+        while len(stats) < workers:
+            message = results.get()
+            if message[0] == 'stats':
+                stats.append(message[1:])
+    finally:
+        for process in processes:
+            process.join(1)
+            if process.is_alive():
+                process.terminate()
+    if isinstance(problem, InstrumentedProblem):
+        for succs, goal_tests, states in stats:
+            problem.succs += succs
+            problem.goal_tests += goal_tests
+            problem.states += states
+    if goal is None:
+        return None
+    node = Node(problem.initial)
+    for action in reversed(actions):
+        node = node.child_node(problem, list(problem.actions(node.state))[action])
+    return node
+
 # ______________________________________________________________________________
 
 # Code to compare searchers on various problems.
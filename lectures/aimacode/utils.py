@@ -8,9 +8,8 @@ import os.path
 import random
 import math
 
-import heapq
 from functools import lru_cache
-from collections import namedtuple, deque, Counter, defaultdict
+from collections import namedtuple, deque, defaultdict
 
 # ______________________________________________________________________________
 # Functions on Sequences and Iterables
@@ -361,33 +360,95 @@ class PriorityQueue(Queue):
     order) is returned first.  Also supports dict-like lookup.
 
     MODIFIED FROM AIMA VERSION
-        - Use heapq
-        - Use an additional dict to track membership
+        - Use an indexed binary heap of (f(item), item) pairs
+        - Items that compare equal (e.g., Nodes with the same state) share
+          a single entry, and a dict from each item to its position in the
+          heap supports lookup of the queued item, deletion and decrease-key
+          in O(log n), so the queue never holds stale duplicate entries
     """
 
     def __init__(self, order=None, f=lambda x: x):
         self.A = []
-        self._A = Counter()
+        self._index = {}
         self.f = f
 
     def append(self, item):
-        heapq.heappush(self.A, (self.f(item), item))
-        self._A[item] += 1
+        """Add item to the queue. If an equal item is already queued, the
+        one with the lower f value is kept."""
+        if item in self._index:
+            self.decrease_key(item)
+            return
+        self.A.append((self.f(item), item))
+        self._index[item] = len(self.A) - 1
+        self._sift_up(len(self.A) - 1)
 
     def __len__(self):
         return len(self.A)
 
     def pop(self):
-        _, item = heapq.heappop(self.A)
-        self._A[item] -= 1
+        _, item = self.A[0]
+        self._remove(0)
         return item
 
     def __contains__(self, item):
-        return self._A[item] > 0
+        return item in self._index
 
     def __getitem__(self, key):
-        if self._A[key] > 0:
-            return key
+        return self.A[self._index[key]][1]
+
+    def __delitem__(self, key):
+        self._remove(self._index[key])
+
+    def decrease_key(self, item):
+        """Replace the queued item equal to item with item if item has a lower
+        f value."""
+        pos = self._index[item]
+        entry = (self.f(item), item)
+        if entry[0] < self.A[pos][0]:
+            del self._index[item]
+            self._index[item] = pos
+            self.A[pos] = entry
+            self._sift_up(pos)
+
+    def _remove(self, pos):
+        A, index = self.A, self._index
+        del index[A[pos][1]]
+        last = A.pop()
+        if pos < len(A):
+            A[pos] = last
+            index[last[1]] = pos
+            self._sift_down(pos)
+            self._sift_up(pos)
+
+    def _sift_up(self, pos):
+        A, index = self.A, self._index
+        entry = A[pos]
+        while pos > 0:
+            parent = (pos - 1) >> 1
+            if not entry < A[parent]:
+                break
+            A[pos] = A[parent]
+            index[A[pos][1]] = pos
+            pos = parent
+        A[pos] = entry
+        index[entry[1]] = pos
+
+    def _sift_down(self, pos):
+        A, index = self.A, self._index
+        size, entry = len(A), A[pos]
+        while True:
+            child = 2 * pos + 1
+            if child >= size:
+                break
+            if child + 1 < size and A[child + 1] < A[child]:
+                child += 1
+            if not A[child] < entry:
+                break
+            A[pos] = A[child]
+            index[A[pos][1]] = pos
+            pos = child
+        A[pos] = entry
+        index[entry[1]] = pos
 
 # ______________________________________________________________________________
 # Useful Shorthands
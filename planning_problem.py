@@ -2,33 +2,176 @@ import sys
 from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent.parent / "lectures"))
 
-from functools import lru_cache
+from copy import copy
+from itertools import chain
 from aimacode.logic import PropKB
 from aimacode.search import Node, Problem
-from _utils import encode_state, decode_state
-from my_planning_graph import PlanningGraph
+from _utils import encode_state, pack_state
+from heuristic_cache import HeuristicCache, cached_heuristic, prefetch_heuristic
+from my_planning_graph import PlanningGraph, batch_goal_levels
+
+try:
+    import numpy as np
+except ImportError:  # numpy is only required for batched expansion
+    np = None
 
     ##############################################################################
     #                 YOU DO NOT NEED TO MODIFY CODE IN THIS FILE                #
     ##############################################################################
 
 
+class SuccessorGenerator:
+    """ Decision tree over fluent indices that returns the actions applicable in
+    a state without testing every precondition of every action
+
+    Each internal node of the tree tests a single fluent and has (up to) three
+    children: the actions that require the fluent to be True, the actions that
+    require it to be False, and the actions that do not mention it. Actions are
+    stored at the node where their last precondition has been tested, so a query
+    only visits the branches consistent with the state.
+
+    See Also
+    --------
+    Helmert, "The Fast Downward Planning System", JAIR 26 (2006), section 5.3.1
+    """
+    def __init__(self, preconditions):
+        """
+        Parameters
+        ----------
+        preconditions : list
+            preconditions[i] is an iterable of (fluent index, bool) pairs that
+            must all hold in a state for action i to be applicable
+        """
+        entries = [(idx, tuple(sorted(set(conds))), 0) for idx, conds in enumerate(preconditions)]
+        self._root = self._build(entries)
+
+    def _build(self, entries):
+        if not entries:
+            return None
+        immediate = tuple(idx for idx, conds, pos in entries if pos == len(conds))
+        pending = [(idx, conds, pos) for idx, conds, pos in entries if pos < len(conds)]
+        if not pending:
+            return (immediate, None, None, None, None)
+        var = min(conds[pos][0] for _, conds, pos in pending)
+        on, off, rest = [], [], []
+        for idx, conds, pos in pending:
+            test, value = conds[pos]
+            if test != var:
+                rest.append((idx, conds, pos))
+            else:
+                (on if value else off).append((idx, conds, pos + 1))
+        return (immediate, var, self._build(on), self._build(off), self._build(rest))
+
+    def applicable(self, state):
+        """ Return the sorted indices of the actions applicable in the state
+
+        Parameters
+        ----------
+        state : tuple(bool) or int
+            A state as an ordered sequence of True/False values, or the same values
+            packed into an integer bitset (see _utils.pack_state)
+        """
+        result = []
+        stack = [self._root] if self._root else []
+        if isinstance(state, int):
+            while stack:
+                immediate, var, on, off, rest = stack.pop()
+                result.extend(immediate)
+                if var is None: continue
+                if rest: stack.append(rest)
+                child = on if state >> var & 1 else off
+                if child: stack.append(child)
+        else:
+            while stack:
+                immediate, var, on, off, rest = stack.pop()
+                result.extend(immediate)
+                if var is None: continue
+                if rest: stack.append(rest)
+                child = on if state[var] else off
+                if child: stack.append(child)
+        result.sort()
+        return result
+
+
 class BasePlanningProblem(Problem):
+    # maximum number of heuristic values kept in the heuristic_cache
+    heuristic_cache_size = 2 ** 16
+
+    # planning graph implementation used by the h_pg_* heuristics; both classes
+    # produce identical heuristic values (see my_planning_graph.BitsetPlanningGraph)
+    planning_graph = PlanningGraph
+
     def __init__(self, initial, goal):
         self.state_map = sorted(initial.pos + initial.neg, key=str)
         self.initial_state_TF = encode_state(initial, self.state_map)
+        self.initial_state_bits = pack_state(self.initial_state_TF)
+        self.goal_mask = pack_state(f in goal for f in self.state_map)
+        self._actions_list = []
+        self._action_masks = {}
+        self._applicable_actions = []
+        self._successor_generator = SuccessorGenerator([])
+        self._action_matrices = None
+        self.heuristic_cache = HeuristicCache(self.heuristic_cache_size)
+        self.heuristic_store = None
         super().__init__(self.initial_state_TF, goal=goal)
 
-    @lru_cache()
+    @property
+    def actions_list(self):
+        return self._actions_list
+
+    @actions_list.setter
+    def actions_list(self, actions):
+        """ Store the concrete actions of the problem and compile the effect
+        bitmasks used to apply them to states in the packed (integer bitset)
+        representation and the successor generator used to find the applicable
+        actions
+        """
+        self._actions_list = list(actions)
+        self._action_matrices = None
+        fluent_idx = {f: idx for idx, f in enumerate(self.state_map)}
+        fluent_bits = {f: 1 << idx for f, idx in fluent_idx.items()}
+
+        def mask(fluents):
+            return sum(fluent_bits.get(f, 0) for f in set(fluents))
+
+        self._action_masks = {
+            action: (mask(action.effect_add), mask(action.effect_rem)) for action in self._actions_list}
+
+        # actions with preconditions outside of state_map are left out of the
+        # successor generator because they are never applicable
+        self._applicable_actions = [
+            action for action in self._actions_list
+            if all(f in fluent_idx for f in chain(action.precond_pos, action.precond_neg))]
+        self._successor_generator = SuccessorGenerator([
+            [(fluent_idx[f], True) for f in action.precond_pos] +
+            [(fluent_idx[f], False) for f in action.precond_neg]
+            for action in self._applicable_actions])
+
+    def packed(self):
+        """ Return a shallow copy of this problem that searches over states packed
+        into integer bitsets rather than tuples of True/False values
+
+        Every method of BasePlanningProblem accepts either representation, so the
+        copy only differs in its initial state; the packed representation is
+        carried through the search because result() preserves the state type.
+        """
+        problem = copy(self)
+        problem.initial = self.initial_state_bits
+        problem.heuristic_cache = HeuristicCache(self.heuristic_cache.maxsize)
+        return problem
+
+    @cached_heuristic
     def h_unmet_goals(self, node):
         """ This heuristic estimates the minimum number of actions that must be
         carried out from the current state in order to satisfy all of the goal
         conditions by ignoring the preconditions required for an action to be
         executed.
         """
+        if isinstance(node.state, int):
+            return (self.goal_mask & ~node.state).bit_count()
         return sum(1 for i, f in enumerate(self.state_map) if not node.state[i] and f in self.goal)
 
-    @lru_cache()
+    @cached_heuristic
     def h_pg_levelsum(self, node):
         """ This heuristic uses a planning graph representation of the problem
         state space to estimate the sum of the number of actions that must be
@@ -39,11 +182,11 @@ class BasePlanningProblem(Problem):
         --------
         Russell-Norvig 10.3.1 (3rd Edition)
         """
-        pg = PlanningGraph(self, node.state, serialize=True, ignore_mutexes=True)
+        pg = self.planning_graph(self, node.state, serialize=True, ignore_mutexes=True)
         score = pg.h_levelsum()
         return score
 
-    @lru_cache()
+    @cached_heuristic
     def h_pg_maxlevel(self, node):
         """ This heuristic uses a planning graph representation of the problem
         to estimate the maximum level cost out of all the individual goal literals.
@@ -54,11 +197,11 @@ class BasePlanningProblem(Problem):
         --------
         Russell-Norvig 10.3.1 (3rd Edition)
         """
-        pg = PlanningGraph(self, node.state, serialize=True, ignore_mutexes=True)
+        pg = self.planning_graph(self, node.state, serialize=True, ignore_mutexes=True)
         score = pg.h_maxlevel()
         return score
 
-    @lru_cache()
+    @cached_heuristic
     def h_pg_setlevel(self, node):
         """ This heuristic uses a planning graph representation of the problem
         to estimate the level cost in the planning graph to achieve all of the
@@ -68,32 +211,172 @@ class BasePlanningProblem(Problem):
         --------
         Russell-Norvig 10.3.1 (3rd Edition)
         """
-        pg = PlanningGraph(self, node.state, serialize=True)
+        pg = self.planning_graph(self, node.state, serialize=True)
         score = pg.h_setlevel()
         return score
 
+    def pg_levels(self, node):
+        """ Return the (h_pg_levelsum, h_pg_maxlevel, h_pg_setlevel) values of the
+        node computed from a single planning graph
+
+        All three values are stored in the heuristic cache, so subsequent calls to
+        the individual heuristics for the same state do not build another graph.
+        """
+        values = []
+
+        def compute(idx):
+            if not values:
+                values.extend(self.planning_graph(self, node.state, serialize=True).h_levels())
+            return values[idx]
+
+        names = ('h_pg_levelsum', 'h_pg_maxlevel', 'h_pg_setlevel')
+        return tuple(self.heuristic_cache.lookup((name, node.state), lambda: compute(idx))
+                     for idx, name in enumerate(names))
+
+    @cached_heuristic
+    def h_ff(self, node):
+        """ This heuristic estimates the number of actions needed to satisfy the
+        goals by the length of a plan for the relaxed problem extracted from the
+        planning graph (ignoring mutexes) of the current state.
+
+        See Also
+        --------
+        my_planning_graph.PlanningGraph.relaxed_plan
+        """
+        return self.relaxed_plan(node)[0]
+
+    def relaxed_plan(self, node):
+        """ Return the h_ff value of the node and the helpful actions of its state
+
+        Helpful actions are the actions applicable in the state that achieve a
+        subgoal of the first step of the relaxed plan; searches can prefer them
+        over the other successors of the node. Both values are computed from a
+        single planning graph and stored in the heuristic cache.
+
+        Returns
+        -------
+        (float, tuple)
+            The h_ff value (inf if a goal is unreachable) and the helpful actions
+            (elements of self.actions_list)
+        """
+        def compute():
+            pg = self.planning_graph(self, node.state, serialize=False, ignore_mutexes=True)
+            plan, helpful = pg.relaxed_plan()
+            if plan is None:
+                return float('inf'), ()
+            compiled = pg._compiled
+            offset = len(compiled.action_nodes) - len(compiled.actions_list)
+            return len(plan), tuple(compiled.actions_list[compiled.action_ids[a] - offset] for a in helpful)
+        return self.heuristic_cache.lookup(('relaxed_plan', node.state), compute)
+
+    def helpful_actions(self, node):
+        """ Return the helpful actions of the node's state (see relaxed_plan) as
+        the preferred operators of aimacode.search.lazy_greedy_search
+        """
+        return self.relaxed_plan(node)[1]
+
+    def heuristic_batch(self, heuristic, states):
+        """ Evaluate a heuristic for many states together and return the values
+
+        h_pg_levelsum and h_pg_maxlevel are computed for all states at once with
+        vectorized relaxed reachability (see my_planning_graph.batch_goal_levels)
+        when numpy is available; other heuristics are evaluated one state at a
+        time. The values are stored in the heuristic cache (and in the heuristic
+        store when one is attached), so this method can be used to prefetch the
+        heuristic values of all the children of a search node (see
+        aimacode.search.best_first_graph_search).
+
+        Parameters
+        ----------
+        heuristic : str or callable
+            A heuristic method of this problem, or its name
+
+        states : iterable
+            States in either representation accepted by the problem
+        """
+        name = getattr(heuristic, '__name__', heuristic)
+        states = list(states)
+        if name in ('h_pg_levelsum', 'h_pg_maxlevel') and np is not None:
+            def evaluate(missing):
+                _, levels = batch_goal_levels(self, missing)
+                values = []
+                for row in levels.tolist():
+                    costs = [level for level in row if level >= 0]
+                    if name == 'h_pg_levelsum':
+                        values.append(sum(costs))
+                    else:
+                        values.append(max(costs, default=0) if len(costs) == len(row) else float('inf'))
+                return values
+            prefetch_heuristic(self, name, states, evaluate)
+        method = getattr(self, name)
+        return [method(Node(state)) for state in states]
+
     def actions(self, state):
         """ Return the actions that can be executed in the given state. """
-        possible_actions = []
-        fluent = decode_state(state, self.state_map)
-        for action in self.actions_list:
-            is_possible = True
-            for clause in action.precond_pos:
-                if clause not in fluent.pos:
-                    is_possible = False
-                    break
-            if not is_possible: continue
-            for clause in action.precond_neg:
-                if clause not in fluent.neg:
-                    is_possible = False
-                    break
-            if is_possible: possible_actions.append(action)
-        return possible_actions
+        actions = self._applicable_actions
+        return [actions[idx] for idx in self._successor_generator.applicable(state)]
+
+    def expand_batch(self, states):
+        """ Expand a batch of states against every action in one vectorized step
+
+        Parameters
+        ----------
+        states : numpy.ndarray
+            A 2-D bool (or 0/1 uint8) array with one row per state and one column
+            per fluent in self.state_map
+
+        Returns
+        -------
+        applicable : numpy.ndarray
+            An N x len(self.actions_list) bool array; applicable[i, j] is True if
+            self.actions_list[j] can be executed in states[i]
+
+        children : numpy.ndarray
+            A K x len(self.state_map) bool array holding the result of every
+            applicable (state, action) pair, in the row-major order given by
+            numpy.nonzero(applicable)
+        """
+        if np is None:
+            raise ImportError("expand_batch() requires numpy")
+        pre_pos, pre_neg, add, rem, never = self._batch_matrices()
+        states = np.asarray(states, dtype=bool).reshape(-1, len(self.state_map))
+        unmet = (~states).astype(np.int32) @ pre_pos.T + states.astype(np.int32) @ pre_neg.T
+        applicable = (unmet == 0) & ~never
+        rows, cols = np.nonzero(applicable)
+        children = (states[rows] & ~rem[cols]) | add[cols]
+        return applicable, children
+
+    def _batch_matrices(self):
+        """ Return the precondition, add and delete matrices (actions x fluents)
+        of the problem, building them on first use
+        """
+        if self._action_matrices is None:
+            fluent_idx = {f: idx for idx, f in enumerate(self.state_map)}
+            shape = (len(self._actions_list), len(self.state_map))
+            pre_pos, pre_neg = np.zeros(shape, dtype=np.int32), np.zeros(shape, dtype=np.int32)
+            add, rem = np.zeros(shape, dtype=bool), np.zeros(shape, dtype=bool)
+            never = np.zeros(shape[0], dtype=bool)
+            for row, action in enumerate(self._actions_list):
+                for matrix, fluents in ((pre_pos, action.precond_pos), (pre_neg, action.precond_neg)):
+                    for f in fluents:
+                        if f in fluent_idx:
+                            matrix[row, fluent_idx[f]] = 1
+                        else:
+                            never[row] = True
+                for matrix, fluents in ((add, action.effect_add), (rem, action.effect_rem)):
+                    for f in fluents:
+                        if f in fluent_idx:
+                            matrix[row, fluent_idx[f]] = True
+            self._action_matrices = (pre_pos, pre_neg, add, rem, never)
+        return self._action_matrices
 
     def result(self, state, action):
         """ Return the state that results from executing the given action in the
         given state. The action must be one of self.actions(state).
         """
+        if isinstance(state, int):
+            add, rem = self._action_masks[action]
+            return (state & ~rem) | add
         return tuple([
             (f and s not in action.effect_rem) or (s in action.effect_add)
             for f, s in zip(state, self.state_map)
@@ -101,4 +384,6 @@ class BasePlanningProblem(Problem):
 
     def goal_test(self, state: str) -> bool:
         """ Test the state to see if goal is reached """
+        if isinstance(state, int):
+            return state & self.goal_mask == self.goal_mask
         return all(f for f, c in zip(state, self.state_map) if c in self.goal)
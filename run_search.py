@@ -1,17 +1,29 @@
 import sys
 from pathlib import Path
 import argparse
+import multiprocessing
+import signal
+from functools import partial
+from inspect import signature
+from queue import Empty
+from timeit import default_timer as timer
 
 # Add lectures directory to Python path
 sys.path.insert(0, str(Path(__file__).parent / "lectures"))
 
 from aimacode.search import (
-    breadth_first_search, astar_search,
+    InstrumentedProblem, Node, breadth_first_search, astar_search,
     depth_first_graph_search, uniform_cost_search,
-    greedy_best_first_graph_search
+    greedy_best_first_graph_search, lazy_greedy_search, TIE_BREAKERS,
+    arena_breadth_first_search, arena_uniform_cost_search, arena_astar_search,
+    iterative_deepening_astar_search, anytime_astar_search, enforced_hill_climbing_search,
+    hash_distributed_astar_search
 )
 from air_cargo_problems import air_cargo_p1, air_cargo_p2, air_cargo_p3, air_cargo_p4
-from _utils import run_search
+from _utils import run_search, show_solution
+from my_planning_graph import BitsetPlanningGraph
+from heuristic_cache import HeuristicStore, problem_fingerprint
+from heuristic_pool import HeuristicPool
 
     ##############################################################################
     #                 YOU DO NOT NEED TO MODIFY CODE IN THIS FILE                #
@@ -48,8 +60,28 @@ SEARCHES = [["breadth_first_search", breadth_first_search, ""],
             ['astar_search', astar_search, 'h_unmet_goals'],
             ['astar_search', astar_search, 'h_pg_levelsum'],
             ['astar_search', astar_search, 'h_pg_maxlevel'],
-            ['astar_search', astar_search, 'h_pg_setlevel']
+            ['astar_search', astar_search, 'h_pg_setlevel'],
+            ['greedy_best_first_graph_search', greedy_best_first_graph_search, 'h_ff'],
+            ['astar_search', astar_search, 'h_ff'],
+            ['lazy_greedy_search', lazy_greedy_search, 'h_pg_levelsum'],
+            ['lazy_greedy_search', lazy_greedy_search, 'h_ff'],
+            ['arena_breadth_first_search', arena_breadth_first_search, ""],
+            ['arena_uniform_cost_search', arena_uniform_cost_search, ""],
+            ['arena_astar_search', arena_astar_search, 'h_unmet_goals'],
+            ['iterative_deepening_astar_search', iterative_deepening_astar_search, 'h_unmet_goals'],
+            ['anytime_astar_search', anytime_astar_search, 'h_unmet_goals'],
+            ['anytime_astar_search', anytime_astar_search, 'h_pg_levelsum'],
+            ['enforced_hill_climbing_search', enforced_hill_climbing_search, 'h_unmet_goals'],
+            ['enforced_hill_climbing_search', enforced_hill_climbing_search, 'h_pg_levelsum'],
+            ['enforced_hill_climbing_search', enforced_hill_climbing_search, 'h_ff'],
+            ['hash_distributed_astar_search', hash_distributed_astar_search, 'h_unmet_goals'],
+            ['hash_distributed_astar_search', hash_distributed_astar_search, 'h_pg_levelsum']
             ]
+# problem methods returning the preferred operators of a node for the heuristics
+# that compute them; passed to the searches that accept a `preferred` argument
+PREFERRED_OPERATORS = {'h_ff': 'helpful_actions'}
+# the searches that store h on their nodes, which the low_h tie-breaking policy reads
+LOW_H_SEARCHES = (astar_search, greedy_best_first_graph_search)
 
 
 def manual():
@@ -74,13 +106,27 @@ def manual():
 Air Cargo Problem Search Script
 
 Usage:
-    python run_search.py [-h] [-m] [-p PROBLEMS] [-s SEARCHES]
+    python run_search.py [-h] [-m] [-p PROBLEMS] [-s SEARCHES] [-b] [-g] [--batch] [-j N] [-t POLICY]
+                         [--budget SECONDS] [--portfolio] [--deadline SECONDS] [--store PATH]
 
 Options:
     -h, --help      Show this help message and exit
     -m, --manual    Manual mode: select problems and searches interactively
     -p PROBLEMS     Comma-separated list of problem numbers to solve (1-4)
     -s SEARCHES     Comma-separated list of search algorithms to run (1-8)
+    -b, --bitset    Search over states packed into integer bitsets
+    -g, --bitset-graph
+                    Build planning graph heuristics with bitset layers
+    --batch         Evaluate heuristics for all siblings of an expansion together
+    -j N            Evaluate heuristics (or run hash_distributed_astar_search) in N worker processes
+    -t POLICY       Break ties between equal f values by fifo, lifo, low_h or deep_g
+                    (low_h is skipped for searches other than A* and greedy best-first)
+    --budget SECONDS
+                    Stop the anytime searches after this wall-clock time
+    --portfolio     Race the searches on each problem in parallel and keep the first plan
+    --deadline SECONDS
+                    With --portfolio, keep the lowest cost plan found within this time
+    --store PATH    Share heuristic values across runs through a sqlite file
 
 Problem Choices (-p):
     1: Air Cargo Problem 1 - Initial state has all packages at airport 1
@@ -105,18 +151,174 @@ Examples:
     # Interactive mode to select problems and searches
     pypy run_search.py -m
 """
-def main(p_choices, s_choices):
+def build_problem(problem_fn, packed=False, bitset_graph=False):
+    problem = problem_fn()
+    if packed:
+        problem = problem.packed()
+    if bitset_graph:
+        problem.planning_graph = BitsetPlanningGraph
+    return problem
+
+
+def _portfolio_worker(choice, problem_fn, packed, bitset_graph, options, results):
+    # terminate() raises SystemExit, so that searches clean up their own worker processes
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(1))
+    _, search_fn, heuristic = SEARCHES[choice-1]
+    problem = build_problem(problem_fn, packed, bitset_graph)
+    options = dict(options, problem_factory=partial(build_problem, problem_fn, packed, bitset_graph))
+    if options.get('tie_breaking') == 'low_h' and search_fn not in LOW_H_SEARCHES:
+        del options['tie_breaking']
+    if heuristic in PREFERRED_OPERATORS:
+        options['preferred'] = getattr(problem, PREFERRED_OPERATORS[heuristic])
+    accepted = signature(search_fn).parameters
+    search = partial(search_fn, **{k: v for k, v in options.items() if k in accepted})
+    ip = InstrumentedProblem(problem)
+    node = search(ip, getattr(problem, heuristic)) if heuristic else search(ip)
+    # actions are sent as indices into actions_list; their expressions are rebuilt in the main process
+    plan = None if node is None else [problem.actions_list.index(action) for action in node.solution()]
+    results.put((choice, plan, ip.succs, ip.goal_tests, ip.states))
+
+
+def run_portfolio(problem_fn, s_choices, packed=False, bitset_graph=False, deadline=None, **options):
+    """ Race several searches on one problem in parallel processes
+
+    Every search in s_choices (indices into SEARCHES) runs in its own process.
+    Without a deadline, the first plan found wins and the other searches are
+    cancelled; with a deadline, the searches that finish within deadline seconds
+    of the start are compared and the lowest cost plan wins (if no plan has been
+    found by then, the first plan found afterwards wins). Searches that have not
+    finished when the winner is chosen are terminated.
+
+    Parameters
+    ----------
+    problem_fn : callable
+        A problem factory from PROBLEMS (e.g., air_cargo_p2)
+
+    s_choices : list(int)
+        The 1-based indices of the SEARCHES entries to race
+
+    deadline : float, optional
+        The time in seconds within which to collect plans
+
+    **options
+        Optional arguments (e.g., tie_breaking or budget) passed to the searches
+        that accept them
+
+    Returns
+    -------
+    (int, Node, float) or (None, None, None)
+        The SEARCHES index of the winning configuration, its solution node for a
+        problem built by problem_fn, and the time in seconds to the first plan
+    """
+    problem = build_problem(problem_fn, packed, bitset_graph)
+    context = multiprocessing.get_context()
+    results = context.Queue()
+    processes = {choice: context.Process(target=_portfolio_worker,
+                                         args=(choice, problem_fn, packed, bitset_graph, options, results))
+                 for choice in map(int, s_choices)}
+    start = timer()
+    for process in processes.values():
+        process.start()
+    finished, plans, first = {}, {}, None
+    try:
+        while len(finished) < len(processes):
+            elapsed = timer() - start
+            if first is not None and (deadline is None or elapsed >= deadline):
+                break
+            try:
+                choice, plan, *stats = results.get(timeout=0.1)
+            except Empty:
+                for choice, process in processes.items():
+                    if choice not in finished and process.exitcode not in (None, 0):
+                        finished[choice] = (timer() - start, None, None)
+                continue
+            finished[choice] = (timer() - start, plan, stats)
+            if plan is not None:
+                node = Node(problem.initial)
+                for action in plan:
+                    node = node.child_node(problem, problem.actions_list[action])
+                plans[choice] = node
+                first = first if first is not None else finished[choice][0]
+    finally:
+        for process in processes.values():
+            if process.is_alive():
+                process.terminate()
+            process.join(5)
+            if process.is_alive():
+                process.kill()
+
+    print("\n{:<48}  {:>8}  {:>10}  {:>11}".format("Search", "Status", "Expansions", "Plan length"))
+    for choice in processes:
+        name, _, heuristic = SEARCHES[choice-1]
+        label = "{}. {} {}".format(choice, name, heuristic)
+        if choice not in finished:
+            row = ("cancelled", "", "")
+        elif choice in plans:
+            row = ("{:.2f}s".format(finished[choice][0]), finished[choice][2][0], len(plans[choice].solution()))
+        else:
+            row = ("failed" if finished[choice][2] is None else "no plan", "", "")
+        print("{:<48}  {:>8}  {:>10}  {:>11}".format(label, *row))
+    if not plans:
+        print("\nNo plan found")
+        return None, None, None
+    winner = min(plans, key=lambda choice: (plans[choice].path_cost, finished[choice][0]))
+    name, _, heuristic = SEARCHES[winner-1]
+    print("\nWinner: {}. {} {}  Time to first plan in seconds: {}".format(winner, name, heuristic, first))
+    show_solution(plans[winner], finished[winner][0])
+    return winner, plans[winner], first
+
+
+def main(p_choices, s_choices, packed=False, store_path=None, bitset_graph=False, batch=False, workers=None,
+         tie_breaking=None, budget=None, portfolio=False, deadline=None):
     problems = [PROBLEMS[i-1] for i in map(int, p_choices)]
     searches = [SEARCHES[i-1] for i in map(int, s_choices)]
 
+    if portfolio:
+        options = {k: v for k, v in [('workers', workers), ('tie_breaking', tie_breaking), ('budget', budget)] if v}
+        for pname, problem_fn in problems:
+            print("\nRacing {} searches on {}...".format(len(searches), pname))
+            run_portfolio(problem_fn, s_choices, packed, bitset_graph, deadline, **options)
+        return
+
     for pname, problem_fn in problems:
         for sname, search_fn, heuristic in searches:
             hstring = heuristic if not heuristic else " with {}".format(heuristic)
             print("\nSolving {} using {}{}...".format(pname, sname, hstring))
 
-            problem_instance = problem_fn()
+            problem_instance = build_problem(problem_fn, packed, bitset_graph)
+            if store_path:
+                problem_instance.heuristic_store = HeuristicStore(
+                    store_path, problem_fingerprint(problem_instance))
             heuristic_fn = None if not heuristic else getattr(problem_instance, heuristic)
-            run_search(problem_instance, search_fn, heuristic_fn)
+            # optional arguments are only passed to the searches that accept them
+            accepted, options, pool, thresholds = signature(search_fn).parameters, {}, None, None
+            if heuristic in PREFERRED_OPERATORS:
+                options['preferred'] = getattr(problem_instance, PREFERRED_OPERATORS[heuristic])
+            if heuristic and 'heuristic_batch' in accepted:
+                if workers:
+                    pool = options['heuristic_batch'] = HeuristicPool(problem_instance, problem_fn, heuristic, workers)
+                elif batch:
+                    options['heuristic_batch'] = partial(problem_instance.heuristic_batch, heuristic)
+            if workers:
+                options['workers'] = workers
+            # parallel searches rebuild the problem in every worker process
+            options['problem_factory'] = partial(build_problem, problem_fn, packed, bitset_graph)
+            if tie_breaking == 'low_h' and search_fn not in LOW_H_SEARCHES and 'tie_breaking' in accepted:
+                print("Skipping low_h tie-breaking: {} does not store h on its nodes".format(sname))
+            elif tie_breaking:
+                options['tie_breaking'] = tie_breaking
+            if budget is not None:
+                options['budget'] = budget
+            if 'thresholds' in accepted:
+                thresholds = options['thresholds'] = []
+            search = partial(search_fn, **{k: v for k, v in options.items() if k in accepted})
+            run_search(problem_instance, search, heuristic_fn)
+            if thresholds is not None:
+                print("f thresholds of the iterations: {}\n".format(thresholds))
+            if pool is not None:
+                pool.close()
+            if problem_instance.heuristic_store is not None:
+                problem_instance.heuristic_store.close()
 
 
 if __name__=="__main__":
@@ -129,12 +331,33 @@ if __name__=="__main__":
                         help="Specify the indices of the problems to solve as a list of space separated values. Choose from: {!s}".format(list(range(1, len(PROBLEMS)+1))))
     parser.add_argument('-s', '--searches', nargs="+", choices=range(1, len(SEARCHES)+1), type=int, metavar='',
                         help="Specify the indices of the search algorithms to use as a list of space separated values. Choose from: {!s}".format(list(range(1, len(SEARCHES)+1))))
+    parser.add_argument('-b', '--bitset', action="store_true",
+                        help="Search over states packed into integer bitsets instead of tuples of booleans.")
+    parser.add_argument('-g', '--bitset-graph', action="store_true",
+                        help="Build planning graph heuristics with bitset layers instead of sets of literals.")
+    parser.add_argument('--batch', action="store_true",
+                        help="Evaluate the heuristic for all children of an expanded node together.")
+    parser.add_argument('-j', '--workers', type=int, metavar='N',
+                        help="Evaluate the heuristic for the children of an expanded node in N worker processes, " +
+                        "or distribute hash_distributed_astar_search over N worker processes.")
+    parser.add_argument('-t', '--tie-breaking', choices=sorted(TIE_BREAKERS),
+                        help="Order frontier nodes with equal f values by this policy instead of by state " +
+                        "(low_h is skipped for searches other than A* and greedy best-first search).")
+    parser.add_argument('--budget', type=float, metavar='SECONDS',
+                        help="Return the best plan that the anytime searches find within this wall-clock time.")
+    parser.add_argument('--portfolio', action="store_true",
+                        help="Race the searches on each problem in parallel processes and keep the first plan found.")
+    parser.add_argument('--deadline', type=float, metavar='SECONDS',
+                        help="With --portfolio, keep the lowest cost plan found within this wall-clock time.")
+    parser.add_argument('--store', metavar='PATH',
+                        help="Read and write heuristic values in a persistent sqlite store shared across runs.")
     args = parser.parse_args()
 
     if args.manual:
         manual()
     elif args.problems and args.searches:
-        main(list(sorted(set(args.problems))), list(sorted(set((args.searches)))))
+        main(list(sorted(set(args.problems))), list(sorted(set((args.searches)))), args.bitset, args.store, args.bitset_graph, args.batch, args.workers,
+             args.tie_breaking, args.budget, args.portfolio, args.deadline)
     else:
         print()
         parser.print_help()
@@ -9,12 +9,12 @@ sys.path.insert(0, str(Path(__file__).parent.parent / "lectures"))
 
 from aimacode.utils import expr
 from aimacode.planning import Action
-from aimacode.search import Node
+from aimacode.search import Node, astar_search
 from example_have_cake import have_cake
 from air_cargo_problems import (
     air_cargo_p1, air_cargo_p2, air_cargo_p3, air_cargo_p4
 )
-from my_planning_graph import PlanningGraph, LiteralLayer, ActionLayer
+from my_planning_graph import PlanningGraph, BitsetPlanningGraph, LiteralLayer, ActionLayer
 from layers import makeNoOp, make_node
 
 
@@ -358,5 +358,86 @@ class Test_8_SetLevelHeuristic(BaseHeuristicTest):
         self.assertEqual(self.ac_problem_4.h_pg_setlevel(self.ac_node_4), 6, self.msg)
 
 
+class Test_9_BitsetPlanningGraph(BaseHeuristicTest):
+    def test_9a_bitset_layers_match(self):
+        for problem in [self.cake_problem, self.ac_problem_1]:
+            for serialize, ignore_mutexes in [(True, True), (True, False), (False, False)]:
+                pg = PlanningGraph(problem, problem.initial, serialize, ignore_mutexes).fill()
+                bits = BitsetPlanningGraph(problem, problem.initial, serialize, ignore_mutexes).fill()
+                self.assertEqual(len(pg.literal_layers), len(bits.literal_layers))
+                for layer, bit_layer in zip(pg.literal_layers + pg.action_layers,
+                                            bits.literal_layers + bits.action_layers):
+                    self.assertEqual(set(layer), set(bit_layer))
+                    for itemA, itemB in combinations(layer, 2):
+                        self.assertEqual(layer.is_mutex(itemA, itemB), bit_layer.is_mutex(itemA, itemB))
+
+    def test_9b_bitset_heuristics_match(self):
+        for problem in [self.cake_problem, self.ac_problem_1, self.ac_problem_2, self.ac_problem_3]:
+            node = Node(problem.initial)
+            expected = [problem.h_pg_levelsum(node), problem.h_pg_maxlevel(node), problem.h_pg_setlevel(node)]
+            problem.planning_graph = BitsetPlanningGraph
+            problem.heuristic_cache.clear()
+            self.assertEqual([problem.h_pg_levelsum(node), problem.h_pg_maxlevel(node),
+                              problem.h_pg_setlevel(node)], expected)
+
+
+class Test_10_SinglePassLevels(BaseHeuristicTest):
+    def test_10a_levels_match(self):
+        for problem in [self.cake_problem, self.ac_problem_1, self.ac_problem_2, self.ac_problem_3]:
+            node = Node(problem.initial)
+            expected = (problem.h_pg_levelsum(node), problem.h_pg_maxlevel(node), problem.h_pg_setlevel(node))
+            self.assertEqual(PlanningGraph(problem, problem.initial).h_levels(), expected)
+            problem.heuristic_cache.clear()
+            self.assertEqual(problem.pg_levels(node), expected)
+            self.assertEqual(problem.h_pg_setlevel(node), expected[2])
+            self.assertEqual(problem.heuristic_cache.misses, 3)
+
+    def test_10b_levelsum_stops_early(self):
+        pg = PlanningGraph(self.ac_problem_2, self.ac_problem_2.initial, ignore_mutexes=True)
+        self.assertEqual(pg.h_levelsum(), 6)
+        self.assertEqual(len(pg.literal_layers), 3)
+
+
+class Test_11_LevelingCounters(BaseHeuristicTest):
+    def test_11a_counters_match_layers(self):
+        for problem in [self.cake_problem, self.ac_problem_1, self.ac_problem_2]:
+            for graph in [PlanningGraph, BitsetPlanningGraph]:
+                for ignore_mutexes in [False, True]:
+                    pg = graph(problem, problem.initial, ignore_mutexes=ignore_mutexes)
+                    pg.verify_leveling = True
+                    pg.fill()
+                    self.assertEqual(pg.literal_layers[-1], pg.literal_layers[-2])
+                    for layer in pg.literal_layers:
+                        self.assertEqual(layer.mutex_count,
+                                         sum(layer.is_mutex(a, b) for a, b in combinations(layer, 2)))
+
+
+class Test_12_RelaxedPlan(BaseHeuristicTest):
+    def test_12a_ff(self):
+        self.assertEqual(self.cake_problem.h_ff(Node(self.cake_problem.initial)), 1)
+        self.assertEqual(self.ac_problem_1.h_ff(Node(self.ac_problem_1.initial)), 6)
+
+    def test_12b_engines_match(self):
+        for problem in [self.cake_problem, self.ac_problem_1, self.ac_problem_2]:
+            plan, helpful = PlanningGraph(problem, problem.initial, ignore_mutexes=True).relaxed_plan()
+            bit_plan, bit_helpful = BitsetPlanningGraph(problem, problem.initial, ignore_mutexes=True).relaxed_plan()
+            self.assertEqual(plan, bit_plan)
+            self.assertEqual(helpful, bit_helpful)
+
+    def test_12c_helpful_actions(self):
+        for problem in [self.cake_problem, self.ac_problem_1, self.ac_problem_2]:
+            node = Node(problem.initial)
+            value, helpful = problem.relaxed_plan(node)
+            self.assertEqual(value, problem.h_ff(node))
+            self.assertTrue(helpful)
+            applicable = problem.actions(problem.initial)
+            self.assertTrue(all(action in applicable for action in helpful))
+
+    def test_12d_goal_state(self):
+        problem = self.ac_problem_1
+        node = astar_search(problem, problem.h_ff)
+        self.assertEqual(problem.relaxed_plan(node), (0, ()))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,286 @@
+import sys
+from pathlib import Path
+import pickle
+import tempfile
+import unittest
+from unittest import mock
+
+# Add lectures directory to Python path
+sys.path.insert(0, str(Path(__file__).parent.parent / "lectures"))
+
+from aimacode.search import Node, breadth_first_search, astar_search
+from example_have_cake import have_cake
+from air_cargo_problems import air_cargo_p1, air_cargo_p2
+from _utils import pack_state, unpack_state
+from planning_problem import SuccessorGenerator
+from layers import compile_problem, LayerEdges
+from my_planning_graph import PlanningGraph, ActionLayer, LiteralLayer
+from heuristic_cache import HeuristicCache, HeuristicStore, problem_fingerprint
+from heuristic_pool import HeuristicPool
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class BaseProblemTest(unittest.TestCase):
+    def setUp(self):
+        self.problems = [have_cake(), air_cargo_p1(), air_cargo_p2()]
+
+    def reachable_states(self, problem, limit=200):
+        """ Collect up to `limit` states reachable from the initial state """
+        states, frontier = [problem.initial], [problem.initial]
+        while frontier and len(states) < limit:
+            state = frontier.pop()
+            for action in problem.actions(state):
+                child = problem.result(state, action)
+                if child not in states:
+                    states.append(child)
+                    frontier.append(child)
+        return states
+
+
+class Test_PackedStates(BaseProblemTest):
+    def test_pack_roundtrip(self):
+        for problem in self.problems:
+            size = len(problem.state_map)
+            self.assertEqual(unpack_state(problem.initial_state_bits, size), problem.initial)
+            self.assertEqual(pack_state(problem.initial), problem.initial_state_bits)
+
+    def test_packed_successors_match(self):
+        for problem in self.problems:
+            size = len(problem.state_map)
+            for state in self.reachable_states(problem):
+                bits = pack_state(state)
+                self.assertEqual(problem.actions(state), problem.actions(bits))
+                self.assertEqual(problem.goal_test(state), problem.goal_test(bits))
+                for action in problem.actions(state):
+                    child = problem.result(bits, action)
+                    self.assertIsInstance(child, int)
+                    self.assertEqual(unpack_state(child, size), problem.result(state, action))
+
+    def test_packed_heuristics_match(self):
+        for problem in self.problems:
+            for state in self.reachable_states(problem, limit=20):
+                bits = pack_state(state)
+                self.assertEqual(problem.h_unmet_goals(Node(state)), problem.h_unmet_goals(Node(bits)))
+                self.assertEqual(problem.h_pg_levelsum(Node(state)), problem.h_pg_levelsum(Node(bits)))
+
+    def test_packed_search(self):
+        problem = air_cargo_p1()
+        node = breadth_first_search(problem)
+        packed_node = breadth_first_search(problem.packed())
+        self.assertIsInstance(packed_node.state, int)
+        self.assertEqual(len(node.solution()), len(packed_node.solution()))
+
+
+class Test_SuccessorGenerator(BaseProblemTest):
+    def test_applicable_actions_match_preconditions(self):
+        for problem in self.problems:
+            for state in self.reachable_states(problem):
+                true_fluents = {f for f, v in zip(problem.state_map, state) if v}
+                expected = [a for a in problem.actions_list
+                            if a.precond_pos <= true_fluents and not a.precond_neg & true_fluents]
+                self.assertEqual(problem.actions(state), expected)
+                self.assertEqual(problem.actions(pack_state(state)), expected)
+
+    def test_empty_generator(self):
+        self.assertEqual(SuccessorGenerator([]).applicable((True, False)), [])
+        self.assertEqual(SuccessorGenerator([[]]).applicable(0), [0])
+
+
+class Test_CompiledProblem(BaseProblemTest):
+    def test_compiled_problem_is_shared(self):
+        problem = air_cargo_p1()
+        compiled = compile_problem(problem)
+        pg = PlanningGraph(problem, problem.initial)
+        self.assertIs(pg._compiled, compiled)
+        self.assertIs(PlanningGraph(problem.packed(), problem.initial_state_bits)._compiled, compiled)
+        problem.actions_list = problem.get_actions()
+        self.assertIsNot(compile_problem(problem), compiled)
+
+    def test_literal_ids(self):
+        problem = air_cargo_p1()
+        compiled = compile_problem(problem)
+        for idx, fluent in enumerate(problem.state_map):
+            self.assertEqual(compiled.literal_ids[fluent], 2 * idx)
+            self.assertEqual(compiled.literal_ids[~fluent], 2 * idx + 1)
+
+    def test_static_mutex_index(self):
+        for problem in self.problems[:2]:
+            compiled = compile_problem(problem)
+            layer = ActionLayer(compiled.action_nodes)
+            for action in compiled.action_nodes:
+                layer.add_inbound_edges(action, action.preconditions)
+                layer.add_outbound_edges(action, action.effects)
+            for actionA in compiled.action_nodes:
+                expected = {actionB for actionB in compiled.action_nodes if actionA != actionB and (
+                    layer._inconsistent_effects(actionA, actionB) or layer._interference(actionA, actionB))}
+                self.assertEqual(set(compiled.static_mutex_index.get(actionA, ())), expected)
+
+
+class Test_LayerEdges(BaseProblemTest):
+    def test_edges_fall_through(self):
+        base = LayerEdges()
+        base.extend('a', [1, 2])
+        edges = LayerEdges(base)
+        edges.extend('a', [3])
+        edges.extend('b', [4])
+        self.assertEqual(edges['a'], {1, 2, 3})
+        self.assertEqual(base['a'], {1, 2})
+        self.assertEqual(edges['c'], set())
+        self.assertNotIn('c', edges)
+        self.assertEqual(sorted(edges), ['a', 'b'])
+        self.assertNotIn('b', base)
+
+    def test_graph_layers_share_edges(self):
+        problem = air_cargo_p1()
+        pg = PlanningGraph(problem, problem.initial).fill()
+        root = pg.literal_layers[0]
+        self.assertEqual(len(root.parents), 0)
+        for previous, layer in zip(pg.literal_layers[1:], pg.literal_layers[2:]):
+            for literal in previous:
+                self.assertLessEqual(previous.parents[literal], layer.parents[literal])
+        for action in pg.action_layers[-1]:
+            self.assertEqual(pg.action_layers[-1].parents[action], action.preconditions)
+            self.assertEqual(pg.action_layers[-1].children[action], action.effects)
+
+
+    def test_edges_shared_by_layers_of_the_same_kind(self):
+        problem = air_cargo_p1()
+        literals = PlanningGraph(problem, problem.initial).fill().literal_layers[-1]
+        self.assertTrue(len(literals.parents))
+        self.assertEqual(len(ActionLayer(literals).parents), 0)
+        self.assertEqual(len(LiteralLayer(literals).parents), len(literals.parents))
+
+
+class Test_HeuristicCache(BaseProblemTest):
+    def test_cache_is_keyed_by_state(self):
+        problem = air_cargo_p1()
+        root = Node(problem.initial)
+        child = root.child_node(problem, problem.actions(problem.initial)[0])
+        same_state = Node(problem.initial, parent=child)
+        value = problem.h_pg_levelsum(root)
+        self.assertEqual(problem.h_pg_levelsum(same_state), value)
+        self.assertEqual((problem.heuristic_cache.hits, problem.heuristic_cache.misses), (1, 1))
+
+    def test_cache_is_bounded(self):
+        cache = HeuristicCache(maxsize=2)
+        for key in [1, 2, 1, 3, 2]:
+            cache.lookup(key, lambda: key * 10)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual((cache.hits, cache.misses, cache.evictions), (1, 4, 2))
+        self.assertIn(3, cache)
+        self.assertNotIn(1, cache)
+
+
+class Test_HeuristicStore(BaseProblemTest):
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = str(Path(self.tmpdir.name) / "heuristics.db")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_values_shared_across_problems(self):
+        first, second = air_cargo_p1(), air_cargo_p1().packed()
+        self.assertEqual(problem_fingerprint(first), problem_fingerprint(second))
+        self.assertNotEqual(problem_fingerprint(first), problem_fingerprint(air_cargo_p2()))
+        first.heuristic_store = HeuristicStore(self.path, problem_fingerprint(first))
+        value = first.h_pg_levelsum(Node(first.initial))
+        first.heuristic_store.close()
+
+        second.heuristic_store = pickle.loads(pickle.dumps(first.heuristic_store))
+        self.assertEqual(second.h_pg_levelsum(Node(second.initial)), value)
+        self.assertEqual((second.heuristic_store.hits, second.heuristic_store.misses), (1, 0))
+        second.heuristic_store.close()
+
+
+@unittest.skipIf(np is None, "numpy is required for batched expansion")
+class Test_BatchExpansion(BaseProblemTest):
+    def test_expand_batch_matches_result(self):
+        for problem in self.problems:
+            states = self.reachable_states(problem, limit=50)
+            applicable, children = problem.expand_batch(np.array(states, dtype=np.uint8))
+            self.assertEqual(applicable.shape, (len(states), len(problem.actions_list)))
+            expected = [problem.result(s, a) for s in states for a in problem.actions(s)]
+            self.assertEqual([tuple(bool(v) for v in row) for row in children], expected)
+            for row, state in enumerate(states):
+                actions = [a for a, ok in zip(problem.actions_list, applicable[row]) if ok]
+                self.assertEqual(actions, problem.actions(state))
+
+
+@unittest.skipIf(np is None, "numpy is required for batched heuristics")
+class Test_BatchHeuristics(BaseProblemTest):
+    def test_heuristic_batch_matches(self):
+        for problem in self.problems:
+            states = self.reachable_states(problem, limit=100)
+            for name in ['h_pg_levelsum', 'h_pg_maxlevel', 'h_unmet_goals']:
+                expected = [getattr(problem, name)(Node(s)) for s in states]
+                problem.heuristic_cache.clear()
+                self.assertEqual(problem.heuristic_batch(name, states), expected)
+
+    def test_heuristic_batch_uses_store(self):
+        problem = air_cargo_p1()
+        states = self.reachable_states(problem, limit=50)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = str(Path(tmpdir) / "heuristics.db")
+            problem.heuristic_store = HeuristicStore(path, problem_fingerprint(problem))
+            expected = problem.heuristic_batch('h_pg_levelsum', states)
+            self.assertEqual(problem.heuristic_store.misses, len(states))
+            problem.heuristic_store.close()
+
+            rerun = air_cargo_p1()
+            rerun.heuristic_store = HeuristicStore(path, problem_fingerprint(rerun))
+            self.assertEqual(rerun.heuristic_batch('h_pg_levelsum', states), expected)
+            self.assertEqual((rerun.heuristic_store.hits, rerun.heuristic_store.misses), (len(states), 0))
+            rerun.heuristic_store.close()
+
+    def test_batched_search(self):
+        problem, batched = air_cargo_p1(), air_cargo_p1()
+        node = astar_search(problem, problem.h_pg_levelsum)
+        batched_node = astar_search(batched, batched.h_pg_levelsum,
+                                    lambda states: batched.heuristic_batch('h_pg_levelsum', states))
+        self.assertEqual([str(a) for a in node.solution()], [str(a) for a in batched_node.solution()])
+
+
+class Test_HeuristicPool(BaseProblemTest):
+    def test_pool_matches_serial(self):
+        problem, pooled = air_cargo_p1(), air_cargo_p1()
+        states = self.reachable_states(problem, limit=50)
+        expected = [problem.h_pg_levelsum(Node(s)) for s in states]
+        with HeuristicPool(pooled, air_cargo_p1, 'h_pg_levelsum', max_workers=2) as pool:
+            self.assertEqual(pool(states), expected)
+            self.assertEqual(pooled.heuristic_cache.hits, len(states))
+
+    def test_pool_uses_store(self):
+        problem = air_cargo_p1()
+        states = self.reachable_states(problem, limit=50)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = str(Path(tmpdir) / "heuristics.db")
+            problem.heuristic_store = HeuristicStore(path, problem_fingerprint(problem))
+            with HeuristicPool(problem, air_cargo_p1, 'h_pg_levelsum', max_workers=2) as pool:
+                expected = pool(states)
+            self.assertEqual(problem.heuristic_store.misses, len(states))
+            problem.heuristic_store.close()
+
+            rerun = air_cargo_p1()
+            rerun.heuristic_store = HeuristicStore(path, problem_fingerprint(rerun))
+            with HeuristicPool(rerun, air_cargo_p1, 'h_pg_levelsum', max_workers=2) as pool:
+                with mock.patch.object(pool, '_evaluate', side_effect=AssertionError("evaluated in a worker")):
+                    self.assertEqual(pool(states), expected)
+            self.assertEqual((rerun.heuristic_store.hits, rerun.heuristic_store.misses), (len(states), 0))
+            rerun.heuristic_store.close()
+
+    def test_pooled_search(self):
+        problem, pooled = air_cargo_p1(), air_cargo_p1()
+        node = astar_search(problem, problem.h_pg_levelsum)
+        with HeuristicPool(pooled, air_cargo_p1, pooled.h_pg_levelsum, max_workers=2) as pool:
+            pooled_node = astar_search(pooled, pooled.h_pg_levelsum, pool)
+        self.assertEqual([str(a) for a in node.solution()], [str(a) for a in pooled_node.solution()])
+
+
+if __name__ == '__main__':
+    unittest.main()
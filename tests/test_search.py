@@ -0,0 +1,341 @@
+import sys
+from pathlib import Path
+import io
+import multiprocessing.queues
+import os
+import pickle
+import random
+import unittest
+from contextlib import redirect_stdout
+from functools import partial
+
+# Add lectures directory to Python path
+sys.path.insert(0, str(Path(__file__).parent.parent / "lectures"))
+
+from unittest import mock
+
+from aimacode.search import (
+    InstrumentedProblem, Node, NodeArena, NodeStore, Problem, TIE_BREAKERS, anytime_astar_search,
+    anytime_weighted_astar_search, arena_astar_search, arena_breadth_first_search, arena_uniform_cost_search,
+    astar_search, breadth_first_search, enforced_hill_climbing_search, greedy_best_first_graph_search,
+    hash_distributed_astar_search, iterative_deepening_astar_search, lazy_greedy_search,
+    infinity, recursive_best_first_search, state_owner, uniform_cost_search
+)
+from aimacode.utils import PriorityQueue
+from example_have_cake import have_cake
+from air_cargo_problems import air_cargo_p1, air_cargo_p2
+from run_search import build_problem, main, run_portfolio
+
+
+class BaseSearchTest(unittest.TestCase):
+    def setUp(self):
+        self.problems = [have_cake(), air_cargo_p1(), air_cargo_p2()]
+
+    def assertValidPlan(self, problem, node):
+        """ Replay the plan of a solution node from the initial state """
+        self.assertIsNotNone(node)
+        state = problem.initial
+        for action in node.solution():
+            self.assertIn(action, problem.actions(state))
+            state = problem.result(state, action)
+        self.assertTrue(problem.goal_test(state))
+
+
+class Test_LazyGreedySearch(BaseSearchTest):
+    def test_finds_plans(self):
+        for problem in self.problems:
+            self.assertValidPlan(problem, lazy_greedy_search(problem, problem.h_unmet_goals))
+            self.assertValidPlan(problem, lazy_greedy_search(problem, problem.h_ff, problem.helpful_actions))
+
+    def test_defers_evaluation(self):
+        problem, lazy_problem = air_cargo_p2(), air_cargo_p2()
+        eager = InstrumentedProblem(problem)
+        greedy_best_first_graph_search(eager, problem.h_pg_levelsum)
+        lazy = InstrumentedProblem(lazy_problem)
+        lazy_greedy_search(lazy, lazy_problem.h_pg_levelsum)
+        # every evaluated node is expanded (or is a goal) under deferred evaluation
+        self.assertEqual(lazy_problem.heuristic_cache.misses, lazy.succs)
+        self.assertLess(lazy_problem.heuristic_cache.misses, problem.heuristic_cache.misses)
+
+    def test_preferred_operators(self):
+        problem = air_cargo_p2()
+        plain, boosted = InstrumentedProblem(air_cargo_p2()), InstrumentedProblem(problem)
+        lazy_greedy_search(plain, plain.h_ff)
+        lazy_greedy_search(boosted, problem.h_ff, problem.helpful_actions, preferred_ratio=3)
+        self.assertLess(boosted.succs, plain.succs)
+
+
+class Test_EnforcedHillClimbing(BaseSearchTest):
+    class PlateauProblem(Problem):
+        """ From S, the first lookahead reaches X and commits to A (the better
+        state); from A, the goal is only reachable through X again """
+        edges = {'S': ['X', 'A'], 'A': ['X'], 'X': ['G'], 'G': []}
+        values = {'S': 3, 'X': 3, 'A': 2, 'G': 0}
+
+        def actions(self, state):
+            return self.edges[state]
+
+        def result(self, state, action):
+            return action
+
+        def h(self, node):
+            return self.values[node.state]
+
+    def test_finds_plans(self):
+        for problem in self.problems:
+            for heuristic in [problem.h_unmet_goals, problem.h_pg_levelsum, problem.h_ff]:
+                self.assertValidPlan(problem, enforced_hill_climbing_search(problem, heuristic))
+            self.assertValidPlan(problem, enforced_hill_climbing_search(problem, problem.h_ff, problem.helpful_actions))
+
+    def test_lookaheads_revisit_states(self):
+        problem = self.PlateauProblem('S', 'G')
+        with mock.patch('aimacode.search.greedy_best_first_graph_search',
+                        side_effect=AssertionError("fell back to greedy search")):
+            node = enforced_hill_climbing_search(problem)
+        self.assertEqual(node.solution(), ['A', 'X', 'G'])
+
+    def test_helpful_actions(self):
+        problem, ehc_problem = air_cargo_p2(), air_cargo_p2()
+        greedy_best_first_graph_search(problem, problem.h_ff)
+        enforced_hill_climbing_search(ehc_problem, ehc_problem.h_ff, ehc_problem.helpful_actions)
+        self.assertLess(ehc_problem.heuristic_cache.misses, problem.heuristic_cache.misses)
+
+    def test_greedy_fallback(self):
+        for problem in self.problems:
+            # a lookahead without any operators finds no better node
+            node = enforced_hill_climbing_search(problem, problem.h_unmet_goals, lambda node: [])
+            self.assertValidPlan(problem, node)
+            expected = greedy_best_first_graph_search(problem, problem.h_unmet_goals)
+            self.assertEqual(node.solution(), expected.solution())
+
+
+class Test_TieBreaking(BaseSearchTest):
+    def test_nodes_are_never_compared(self):
+        expected = [len(astar_search(problem, problem.h_unmet_goals).solution()) for problem in self.problems]
+        with mock.patch.object(Node, '__lt__', side_effect=AssertionError("Node.__lt__ called")):
+            for policy in TIE_BREAKERS:
+                for problem, length in zip(self.problems, expected):
+                    node = astar_search(problem, problem.h_unmet_goals, tie_breaking=policy)
+                    self.assertValidPlan(problem, node)
+                    self.assertEqual(len(node.solution()), length)
+                    self.assertValidPlan(problem, greedy_best_first_graph_search(
+                        problem, problem.h_unmet_goals, tie_breaking=policy))
+                    if policy != 'low_h':
+                        self.assertValidPlan(problem, uniform_cost_search(problem, tie_breaking=policy))
+
+    def test_low_h_needs_h(self):
+        problem = self.problems[1]
+        with self.assertRaises(ValueError):
+            uniform_cost_search(problem, tie_breaking='low_h')
+        node = greedy_best_first_graph_search(problem, problem.h_unmet_goals, tie_breaking='low_h')
+        self.assertEqual(node.h, 0)
+        self.assertEqual(node.f, node.h)
+
+    def test_low_h_skipped_by_run_search(self):
+        output = io.StringIO()
+        with redirect_stdout(output):
+            main([1], [3, 8], tie_breaking='low_h')
+        self.assertIn("Skipping low_h tie-breaking: uniform_cost_search", output.getvalue())
+        self.assertEqual(output.getvalue().count("Plan length: 6"), 2)
+
+    def test_low_h_tie_breaking(self):
+        fifo, low_h = InstrumentedProblem(air_cargo_p2()), InstrumentedProblem(air_cargo_p2())
+        astar_search(fifo, fifo.h_unmet_goals, tie_breaking='fifo')
+        astar_search(low_h, low_h.h_unmet_goals, tie_breaking='low_h')
+        self.assertLess(low_h.succs, fifo.succs)
+
+
+class Test_NodeStore(BaseSearchTest):
+    def test_nodes_are_slotted(self):
+        problem = self.problems[1]
+        node = astar_search(problem, problem.h_unmet_goals)
+        self.assertFalse(hasattr(node, '__dict__'))
+        self.assertEqual(node.f, node.g + node.h)
+        self.assertEqual(node.h, 0)
+
+    def test_stored_searches_match(self):
+        for problem in self.problems:
+            for search in [breadth_first_search, uniform_cost_search,
+                           lambda p, **kw: astar_search(p, p.h_unmet_goals, **kw)]:
+                store = NodeStore()
+                node, stored = search(problem), search(problem, node_store=store)
+                self.assertEqual(stored.solution(), node.solution())
+                self.assertEqual([n.state for n in stored.path()], [n.state for n in node.path()])
+                self.assertEqual([n.depth for n in stored.path()], list(range(len(node.solution()) + 1)))
+                self.assertGreaterEqual(len(store), len(node.solution()))
+
+
+class Test_NodeArena(BaseSearchTest):
+    def test_arena_breadth_first_search(self):
+        for problem in self.problems:
+            for p in [problem, problem.packed()]:
+                expected, instrumented = InstrumentedProblem(p), InstrumentedProblem(p)
+                node = breadth_first_search(expected)
+                arena_node = arena_breadth_first_search(instrumented)
+                self.assertValidPlan(p, arena_node)
+                self.assertEqual(len(arena_node.solution()), len(node.solution()))
+                self.assertEqual((instrumented.succs, instrumented.states), (expected.succs, expected.states))
+
+    def test_arena_optimal_searches(self):
+        for problem in self.problems:
+            length = len(uniform_cost_search(problem).solution())
+            for p in [problem, problem.packed()]:
+                for node in [arena_uniform_cost_search(p), arena_astar_search(p, p.h_unmet_goals)]:
+                    self.assertValidPlan(p, node)
+                    self.assertEqual(node.path_cost, length)
+                    self.assertEqual([n.depth for n in node.path()], list(range(length + 1)))
+
+    def test_arena_storage(self):
+        problem = self.problems[1]
+        arena = NodeArena(packed=True)
+        arena_uniform_cost_search(problem.packed(), arena)
+        self.assertEqual(arena.states.typecode, 'Q')
+        self.assertEqual(len(arena.states), len(arena))
+        self.assertLessEqual(len(arena.actions), len(problem.actions_list))
+        arena = NodeArena(packed=True)
+        arena.add(1 << 70)
+        self.assertEqual(arena.states, [1 << 70])
+
+
+class Test_IterativeDeepeningAStar(BaseSearchTest):
+    def test_optimal_plans(self):
+        for problem in self.problems:
+            length = len(uniform_cost_search(problem).solution())
+            # a tiny table evicts most states, which only costs duplicate pruning
+            for table_size in ([2 ** 16, 16] if problem is not self.problems[-1] else [2 ** 16]):
+                thresholds = []
+                node = iterative_deepening_astar_search(problem, problem.h_unmet_goals, table_size, thresholds)
+                self.assertValidPlan(problem, node)
+                self.assertEqual(len(node.solution()), length)
+                self.assertEqual(thresholds[-1], length)
+                self.assertEqual(thresholds, sorted(set(thresholds)))
+
+    def test_run_search_reports_thresholds(self):
+        output = io.StringIO()
+        with redirect_stdout(output):
+            main([1], [19])
+        self.assertIn("f thresholds of the iterations: [2, 3, 4, 5, 6]", output.getvalue())
+
+    def test_recursive_best_first_search(self):
+        problem = self.problems[1]
+        node = recursive_best_first_search(problem, problem.h_unmet_goals)
+        self.assertValidPlan(problem, node)
+        self.assertEqual(len(node.solution()), 6)
+
+
+class Test_AnytimeSearch(BaseSearchTest):
+    def test_improving_plans(self):
+        for problem in self.problems:
+            length = len(uniform_cost_search(problem).solution())
+            results = list(anytime_weighted_astar_search(problem, problem.h_unmet_goals))
+            for node, bound in results:
+                self.assertValidPlan(problem, node)
+                self.assertLessEqual(node.path_cost, bound * length)
+            costs, bounds = [n.path_cost for n, _ in results], [b for _, b in results]
+            self.assertEqual(costs, sorted(costs, reverse=True))
+            self.assertEqual(bounds, sorted(bounds, reverse=True))
+            self.assertEqual((costs[-1], bounds[-1]), (length, 1))
+
+    def test_budget(self):
+        problem = self.problems[-1]
+        self.assertValidPlan(problem, anytime_astar_search(problem, problem.h_unmet_goals, budget=0))
+        node = anytime_astar_search(problem, problem.h_unmet_goals)
+        self.assertEqual(len(node.solution()), len(uniform_cost_search(problem).solution()))
+
+
+class Test_HashDistributedAStar(BaseSearchTest):
+    def test_optimal_plans(self):
+        for factory in [have_cake, air_cargo_p1, air_cargo_p2, partial(build_problem, air_cargo_p2, True)]:
+            problem = factory()
+            length = len(uniform_cost_search(problem).solution())
+            for workers in [1, 3]:
+                node = hash_distributed_astar_search(problem, problem.h_unmet_goals, factory, workers)
+                self.assertValidPlan(problem, node)
+                self.assertEqual(node.path_cost, length)
+
+    def test_late_goal_messages(self):
+        get, main = multiprocessing.queues.Queue.get, os.getpid()
+        injected = []
+
+        def get_late_goal(queue, *args, **kwargs):
+            message = get(queue, *args, **kwargs)
+            if os.getpid() == main and message[0] == 'trace' and len(message) == 3 and not injected:
+                # deliver a goal message of a worse plan before the first trace reply
+                injected.append(message)
+                queue.put(message)
+                return 'goal', infinity, problem.initial
+            return message
+
+        problem = air_cargo_p1()
+        with mock.patch.object(multiprocessing.queues.Queue, 'get', get_late_goal):
+            node = hash_distributed_astar_search(problem, problem.h_unmet_goals, air_cargo_p1, workers=2)
+        self.assertTrue(injected)
+        self.assertValidPlan(problem, node)
+        self.assertEqual(len(node.solution()), 6)
+
+    def test_worker_statistics(self):
+        problem = InstrumentedProblem(air_cargo_p1())
+        hash_distributed_astar_search(problem, problem.h_unmet_goals, air_cargo_p1, workers=2, batch_size=4)
+        self.assertGreater(problem.succs, len(problem.actions_list))
+
+    def test_state_owner(self):
+        problem = air_cargo_p2()
+        states = [problem.initial, problem.packed().initial, (True, False), 1 << 70, 'SFO']
+        for workers in [1, 2, 7]:
+            for state in states:
+                self.assertIn(state_owner(state, workers), range(workers))
+                self.assertEqual(state_owner(state, workers), state_owner(pickle.loads(pickle.dumps(state)), workers))
+        owners = {state_owner(state, 4) for state in range(64)}
+        self.assertEqual(owners, set(range(4)))
+
+
+class Test_Portfolio(BaseSearchTest):
+    def test_first_plan_wins(self):
+        with redirect_stdout(io.StringIO()):
+            winner, node, first = run_portfolio(air_cargo_p1, [1, 4, 9])
+        self.assertIn(winner, [1, 4, 9])
+        self.assertTrue(air_cargo_p1().goal_test(node.state))
+        self.assertGreater(first, 0)
+
+    def test_best_plan_within_deadline(self):
+        output = io.StringIO()
+        with redirect_stdout(output):
+            winner, node, first = run_portfolio(air_cargo_p2, [3, 4], packed=True, deadline=60)
+        # greedy search finds a longer plan first; uniform cost search finds the optimal one
+        self.assertEqual(winner, 3)
+        self.assertEqual(len(node.solution()), 9)
+        self.assertLess(first, 60)
+        self.assertNotIn("cancelled", output.getvalue())
+
+
+class Test_PriorityQueue(unittest.TestCase):
+    def test_pops_in_order(self):
+        rng = random.Random(0)
+        values = rng.sample(range(1000), 200)
+        queue = PriorityQueue(min, lambda x: -x)
+        for value in values:
+            queue.append(value)
+        for value in values[:50]:
+            del queue[value]
+        self.assertEqual([queue.pop() for _ in range(len(queue))], sorted(values[50:], reverse=True))
+
+    def test_equal_items_share_an_entry(self):
+        queue = PriorityQueue(min, lambda node: node.path_cost)
+        incumbent = Node('A', path_cost=5)
+        queue.append(incumbent)
+        queue.append(Node('B', path_cost=3))
+        queue.append(Node('A', path_cost=7))
+        self.assertEqual(len(queue), 2)
+        self.assertIs(queue[Node('A')], incumbent)
+
+        better = Node('A', path_cost=1)
+        queue.decrease_key(better)
+        self.assertIs(queue[Node('A')], better)
+        self.assertIs(queue.pop(), better)
+        self.assertNotIn(Node('A'), queue)
+        self.assertEqual(queue.pop().state, 'B')
+        self.assertEqual(len(queue), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()